@@ -3,17 +3,254 @@ Script di Analisi: Stima Tempi per la TUA Cartella
 Analizza una cartella e ti dice esattamente quanto tempo ci vorrà
 """
 
+import argparse
+import csv
+import hashlib
+import heapq
+import json
 import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from collections import defaultdict
 from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 import humanize
 
+from archives import ARCHIVE_EXTENSIONS, archive_extension
+
 # Configura humanize per italiano
 humanize.i18n.activate("it_IT")
 
+# Documenti + archivi e caselle di posta (letti membro per membro)
+# (estensioni multiple come .tar.gz: un .gz qualsiasi non è un archivio)
+SUPPORTED_EXTENSIONS = {'.pdf', '.txt', '.docx', '.doc', *ARCHIVE_EXTENSIONS}
+
+# Benchmark reali con Ollama: ~17 file/minuto, ~6.5 MB/minuto
+OLLAMA_FILES_PER_MINUTE = 17
+OLLAMA_MB_PER_MINUTE = 6.5
+
+SNAPSHOT_VERSION = 1
+
+
+def file_extension(name: str) -> str:
+    """Extension used for support checks: '.tar.gz' for archives, else the last suffix"""
+    return archive_extension(name) or Path(name).suffix.lower()
+
+
+def _list_dir(directory: str, cached: Dict) -> Optional[Dict]:
+    """
+    Files and subdirectories of one directory, reused from cache if its mtime is unchanged
+
+    Adding, removing or renaming entries updates the directory mtime, so an
+    unchanged directory needs one stat instead of one per file.
+    """
+    try:
+        mtime = os.stat(directory).st_mtime
+    except OSError:
+        return None
+
+    entry = cached.get(directory)
+    if entry is not None and entry['mtime'] == mtime:
+        return dict(entry)
+
+    entry = {'mtime': mtime, 'files': [], 'subdirs': [], 'rescanned': True}
+    try:
+        with os.scandir(directory) as it:
+            for item in it:
+                try:
+                    if item.is_dir(follow_symlinks=False):
+                        entry['subdirs'].append(item.name)
+                    elif item.is_file(follow_symlinks=False):
+                        stat = item.stat(follow_symlinks=False)
+                        entry['files'].append([item.name, stat.st_size, stat.st_mtime])
+                except OSError:
+                    pass  # Ignora file inaccessibili
+    except OSError:
+        return None
+    return entry
+
+
+def _scan_tree(top: str, cached: Dict) -> Dict:
+    """Walk one subtree; subdirectories are always visited (their changes do not touch the parent)"""
+    dirs = {}
+    stack = [top]
+    while stack:
+        directory = stack.pop()
+        entry = _list_dir(directory, cached)
+        if entry is None:
+            continue
+        dirs[directory] = entry
+        stack.extend(os.path.join(directory, name) for name in entry['subdirs'])
+    return dirs
+
+
+def snapshot_path_for(folder_path: str, cache_dir: str) -> Path:
+    root = str(Path(folder_path).resolve())
+    slug = re.sub(r'[^a-zA-Z0-9_-]+', '-', Path(root).name).strip('-') or 'root'
+    return Path(cache_dir) / f"{slug}-{hashlib.sha1(root.encode('utf-8')).hexdigest()[:8]}.json"
+
+
+def scan_folder(
+    folder_path: str,
+    workers: Optional[int] = None,
+    cache_dir: Optional[str] = None
+) -> Tuple[List[Dict], Dict]:
+    """
+    List every file under folder_path, subtrees scanned in parallel
+
+    Args:
+        folder_path: Folder to scan
+        workers: Scanning threads (default: 8, scandir waits on the disk/share)
+        cache_dir: Folder for scan snapshots; with it only directories whose
+                   mtime changed since the last run are listed again
+                   (a file modified in place keeps the old size/mtime)
+
+    Returns:
+        (files, info) where each file is {path, extension, size, mtime} and
+        info has directories, rescanned directories and seconds
+    """
+    started = datetime.now()
+    root = str(Path(folder_path).resolve())
+
+    cached = {}
+    snapshot_file = snapshot_path_for(root, cache_dir) if cache_dir else None
+    if snapshot_file and snapshot_file.exists():
+        try:
+            data = json.loads(snapshot_file.read_text(encoding='utf-8'))
+            if data.get('version') == SNAPSHOT_VERSION and data.get('root') == root:
+                cached = data['dirs']
+        except (OSError, ValueError):
+            cached = {}
+
+    # La radice in questo thread, ogni sottocartella di primo livello in parallelo
+    root_entry = _list_dir(root, cached)
+    dirs = {root: root_entry} if root_entry else {}
+    tops = [os.path.join(root, name) for name in root_entry['subdirs']] if root_entry else []
+    with ThreadPoolExecutor(max_workers=workers or 8) as executor:
+        for subtree in executor.map(lambda top: _scan_tree(top, cached), tops):
+            dirs.update(subtree)
+
+    rescanned = sum(1 for entry in dirs.values() if entry.pop('rescanned', False))
 
-def analyze_folder(folder_path: str):
+    if snapshot_file:
+        snapshot_file.parent.mkdir(parents=True, exist_ok=True)
+        snapshot_file.write_text(
+            json.dumps({'version': SNAPSHOT_VERSION, 'root': root,
+                        'scanned': started.isoformat(timespec='seconds'), 'dirs': dirs}),
+            encoding='utf-8'
+        )
+
+    files = [
+        {
+            'path': os.path.join(directory, name),
+            'extension': file_extension(name),
+            'size': size,
+            'mtime': mtime
+        }
+        for directory, entry in dirs.items()
+        for name, size, mtime in entry['files']
+    ]
+    info = {
+        'root': root,
+        'directories': len(dirs),
+        'rescanned_directories': rescanned,
+        'seconds': (datetime.now() - started).total_seconds()
+    }
+    return files, info
+
+
+def build_stats(files: List[Dict]) -> Dict:
+    """Counts and sizes by extension and age (same keys as the text report)"""
+    stats = {
+        'total_files': 0,
+        'total_size': 0,
+        'supported_files': 0,
+        'supported_size': 0,
+        'by_extension': defaultdict(lambda: {'count': 0, 'size': 0}),
+        'by_age': defaultdict(lambda: {'count': 0, 'size': 0}),
+        'large_files': [],  # File > 10 MB
+    }
+    
+    # Calcola età dei file
+    now = datetime.now()
+    one_month = (now - timedelta(days=30)).timestamp()
+    six_months = (now - timedelta(days=180)).timestamp()
+    one_year = (now - timedelta(days=365)).timestamp()
+    
+    for f in files:
+        stats['total_files'] += 1
+        stats['total_size'] += f['size']
+        
+        # Per estensione
+        stats['by_extension'][f['extension']]['count'] += 1
+        stats['by_extension'][f['extension']]['size'] += f['size']
+        
+        # Per età
+        if f['mtime'] > one_month:
+            age = 'ultimo_mese'
+        elif f['mtime'] > six_months:
+            age = 'ultimi_6_mesi'
+        elif f['mtime'] > one_year:
+            age = 'ultimo_anno'
+        else:
+            age = 'piu_vecchio'
+        
+        stats['by_age'][age]['count'] += 1
+        stats['by_age'][age]['size'] += f['size']
+        
+        # File supportati
+        if f['extension'] in SUPPORTED_EXTENSIONS:
+            stats['supported_files'] += 1
+            stats['supported_size'] += f['size']
+            
+            # File grandi
+            if f['size'] > 10 * 1024 * 1024:  # > 10 MB
+                stats['large_files'].append({
+                    'path': f['path'],
+                    'size': f['size'],
+                    'name': Path(f['path']).name
+                })
+    
+    stats['by_extension'] = dict(stats['by_extension'])
+    stats['by_age'] = dict(stats['by_age'])
+    return stats
+
+
+def file_cost_minutes(size: int) -> float:
+    """Estimated Ollama processing time of one file (per-file or per-MB bound)"""
+    return max(1 / OLLAMA_FILES_PER_MINUTE, size / (1024 * 1024) / OLLAMA_MB_PER_MINUTE)
+
+
+def plan_batches(files: List[Dict], batches: int) -> List[Dict]:
+    """
+    Partition supported files into batches of similar estimated cost
+
+    Longest-processing-time first: files sorted by cost, each assigned
+    to the currently lightest batch.
+    """
+    supported = [f for f in files if f['extension'] in SUPPORTED_EXTENSIONS]
+    plan = [{'batch': i + 1, 'files': [], 'size': 0, 'minutes': 0.0} for i in range(max(1, batches))]
+    heap = [(0.0, i) for i in range(len(plan))]
+    
+    for f in sorted(supported, key=lambda f: f['size'], reverse=True):
+        minutes, i = heapq.heappop(heap)
+        cost = file_cost_minutes(f['size'])
+        plan[i]['files'].append({'path': f['path'], 'size': f['size'], 'minutes': round(cost, 3)})
+        plan[i]['size'] += f['size']
+        plan[i]['minutes'] += cost
+        heapq.heappush(heap, (minutes + cost, i))
+    
+    return plan
+
+
+def analyze_folder(
+    folder_path: str,
+    workers: Optional[int] = None,
+    cache_dir: Optional[str] = None,
+    batches: int = 4
+):
     """Analizza una cartella e stima i tempi di processing"""
     
     base = Path(folder_path)
@@ -27,69 +264,13 @@ def analyze_folder(folder_path: str):
     print("="*80 + "\n")
     print("⏳ Scansione in corso...\n")
     
-    # Statistiche
-    stats = {
-        'total_files': 0,
-        'total_size': 0,
-        'supported_files': 0,
-        'supported_size': 0,
-        'by_extension': defaultdict(lambda: {'count': 0, 'size': 0}),
-        'by_age': defaultdict(lambda: {'count': 0, 'size': 0}),
-        'large_files': [],  # File > 10 MB
-    }
+    files, scan_info = scan_folder(folder_path, workers=workers, cache_dir=cache_dir)
+    stats = build_stats(files)
+    supported_extensions = SUPPORTED_EXTENSIONS
     
-    supported_extensions = {'.pdf', '.txt', '.docx', '.doc'}
-    
-    # Calcola età dei file
-    now = datetime.now()
-    one_month = now - timedelta(days=30)
-    six_months = now - timedelta(days=180)
-    one_year = now - timedelta(days=365)
-    
-    # Scansiona ricorsivamente
-    for file_path in base.rglob('*'):
-        if file_path.is_file():
-            try:
-                stats['total_files'] += 1
-                file_size = file_path.stat().st_size
-                stats['total_size'] += file_size
-                
-                extension = file_path.suffix.lower()
-                file_time = datetime.fromtimestamp(file_path.stat().st_mtime)
-                
-                # Per estensione
-                stats['by_extension'][extension]['count'] += 1
-                stats['by_extension'][extension]['size'] += file_size
-                
-                # Per età
-                if file_time > one_month:
-                    age = 'ultimo_mese'
-                elif file_time > six_months:
-                    age = 'ultimi_6_mesi'
-                elif file_time > one_year:
-                    age = 'ultimo_anno'
-                else:
-                    age = 'piu_vecchio'
-                
-                stats['by_age'][age]['count'] += 1
-                stats['by_age'][age]['size'] += file_size
-                
-                # File supportati
-                if extension in supported_extensions:
-                    stats['supported_files'] += 1
-                    stats['supported_size'] += file_size
-                    
-                    # File grandi
-                    if file_size > 10 * 1024 * 1024:  # > 10 MB
-                        stats['large_files'].append({
-                            'path': file_path,
-                            'size': file_size,
-                            'name': file_path.name
-                        })
-            
-            except (PermissionError, OSError) as e:
-                # Ignora file inaccessibili
-                pass
+    print(f"🔎 {scan_info['directories']:,} cartelle, "
+          f"{scan_info['rescanned_directories']:,} rilette "
+          f"({scan_info['seconds']:.1f}s)\n")
     
     # ==================== RISULTATI ====================
     
@@ -104,7 +285,7 @@ def analyze_folder(folder_path: str):
     print(f"Dimensione totale:          {humanize.naturalsize(stats['total_size'], binary=True)}")
     print(f"Dimensione media per file:  {humanize.naturalsize(stats['total_size'] // stats['total_files'] if stats['total_files'] > 0 else 0, binary=True)}")
     
-    print(f"\n✅ File supportati (PDF/DOCX/TXT/DOC):")
+    print(f"\n✅ File supportati (PDF/DOCX/TXT/DOC, ZIP/TAR, EML/MBOX/MSG):")
     print(f"   Numero:     {stats['supported_files']:,} ({stats['supported_files']/stats['total_files']*100:.1f}% del totale)")
     print(f"   Dimensione: {humanize.naturalsize(stats['supported_size'], binary=True)}")
     
@@ -164,8 +345,8 @@ def analyze_folder(folder_path: str):
     # Ollama: ~15-20 file/minuto, ~5-8 MB/minuto
     # OpenAI: ~40-60 file/minuto, ~15-25 MB/minuto
     
-    ollama_time_files = num_files / 17  # minuti
-    ollama_time_size = total_size_mb / 6.5  # minuti
+    ollama_time_files = num_files / OLLAMA_FILES_PER_MINUTE  # minuti
+    ollama_time_size = total_size_mb / OLLAMA_MB_PER_MINUTE  # minuti
     ollama_time = max(ollama_time_files, ollama_time_size)
     
     openai_time_files = num_files / 50  # minuti
@@ -262,6 +443,15 @@ def analyze_folder(folder_path: str):
     if estimated_db_size > 1024 * 1024 * 1024:  # > 1 GB
         print(f"   ⚠️  Database grande! Assicurati di avere spazio sufficiente.")
     
+    # Piano di indicizzazione a lotti bilanciati
+    if num_files and batches > 1:
+        print(f"\n📦 PIANO DI INDICIZZAZIONE ({batches} lotti bilanciati)")
+        print("-" * 80)
+        for batch in plan_batches(files, batches):
+            print(f"   Lotto {batch['batch']}: {len(batch['files']):6,} file  "
+                  f"{humanize.naturalsize(batch['size'], binary=True):>10}  "
+                  f"~{batch['minutes']:.0f} min")
+    
     print("\n" + "="*80)
     print("✅ Analisi completata!")
     print("="*80)
@@ -269,20 +459,94 @@ def analyze_folder(folder_path: str):
     return stats
 
 
-if __name__ == "__main__":
-    import sys
+def build_report(
+    folders: List[str],
+    workers: Optional[int] = None,
+    cache_dir: Optional[str] = None,
+    batches: int = 4
+) -> Dict:
+    """Scan one or more folders and return stats, estimates and a batch plan as plain data"""
+    files = []
+    scans = []
+    for folder in folders:
+        folder_files, info = scan_folder(folder, workers=workers, cache_dir=cache_dir)
+        files.extend(folder_files)
+        scans.append(info)
+    
+    stats = build_stats(files)
+    size_mb = stats['supported_size'] / (1024 * 1024)
+    
+    return {
+        'generated': datetime.now().isoformat(timespec='seconds'),
+        'scans': scans,
+        'stats': stats,
+        'estimate': {
+            'ollama_minutes': max(stats['supported_files'] / OLLAMA_FILES_PER_MINUTE,
+                                  size_mb / OLLAMA_MB_PER_MINUTE),
+            'vector_db_bytes': int(stats['supported_size'] * 0.2)
+        },
+        'plan': plan_batches(files, batches)
+    }
+
+
+def write_report(report: Dict, output_format: str, output=None):
+    """JSON (whole report) or CSV (one row per planned file) to output (default stdout)"""
+    output = output or sys.stdout
     
-    # Path da analizzare
-    if len(sys.argv) > 1:
-        folder_path = sys.argv[1]
-    else:
+    if output_format == 'json':
+        json.dump(report, output, indent=2, ensure_ascii=False)
+        output.write("\n")
+        return
+    
+    writer = csv.writer(output)
+    writer.writerow(['batch', 'path', 'extension', 'size', 'cost_minutes'])
+    for batch in report['plan']:
+        for f in batch['files']:
+            writer.writerow([batch['batch'], f['path'], file_extension(f['path']),
+                             f['size'], f['minutes']])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analisi cartelle e piano di indicizzazione")
+    parser.add_argument('folders', nargs='*', help="Cartelle da analizzare")
+    parser.add_argument('--format', choices=['text', 'json', 'csv'], default='text')
+    parser.add_argument('--output', help="File di output per json/csv (default: stdout)")
+    parser.add_argument('--workers', type=int, help="Thread di scansione (default: 8)")
+    parser.add_argument('--cache-dir', default='.analyzer_cache',
+                        help="Snapshot delle scansioni; '' per disattivare")
+    parser.add_argument('--batches', type=int, default=4, help="Lotti del piano di indicizzazione")
+    args = parser.parse_args()
+    
+    folders = args.folders
+    if not folders:
         print("📁 Inserisci il percorso della cartella da analizzare:")
         print("   (Es: /Users/nome/Desktop/Scrivania)")
         print()
         folder_path = input("Percorso: ").strip()
+        
+        if not folder_path:
+            folder_path = "./documents"
+            print(f"\n→ Uso cartella di default: {folder_path}\n")
+        folders = [folder_path]
+    
+    cache_dir = args.cache_dir or None
+    
+    if args.format == 'text':
+        for folder_path in folders:
+            analyze_folder(folder_path, workers=args.workers, cache_dir=cache_dir, batches=args.batches)
+        return
     
-    if not folder_path:
-        folder_path = "./documents"
-        print(f"\n→ Uso cartella di default: {folder_path}\n")
+    missing = [f for f in folders if not Path(f).is_dir()]
+    if missing:
+        parser.error(f"cartelle non trovate: {', '.join(missing)}")
     
-    analyze_folder(folder_path)
\ No newline at end of file
+    report = build_report(folders, workers=args.workers, cache_dir=cache_dir, batches=args.batches)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as output:
+            write_report(report, args.format, output)
+    else:
+        write_report(report, args.format)
+
+
+if __name__ == "__main__":
+    main()
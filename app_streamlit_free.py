@@ -4,8 +4,11 @@ Streamlit Web Interface - 100% GRATUITA con Ollama
 
 import streamlit as st
 import subprocess
+import time
 from pathlib import Path
 from rag_free_ollama import FreeLocalRAG
+from archives import archive_extension
+from warmup import loaded_models
 
 st.set_page_config(
     page_title="RAG Gratuito con Ollama",
@@ -62,16 +65,80 @@ def check_ollama():
         return False, "Ollama timeout"
 
 
+@st.cache_data(ttl=10, show_spinner=False)
+def cached_loaded_models():
+    """/api/ps at most every 10 s: the page reruns every second while indexing"""
+    return loaded_models()
+
+
 @st.cache_resource
-def init_rag(docs_path, model_name):
-    """Initialize RAG system"""
+def get_engine(docs_path, shard_by="root"):
+    """
+    One RAG engine per documents folder, shared by all sessions
+    
+    The LLM is picked per query, so changing model never re-indexes.
+    Indexing runs in a background thread: poll rag.progress.
+    """
     rag = FreeLocalRAG(
         documents_path=docs_path,
-        model_name=model_name
+        shard_by=shard_by
     )
-    if rag.initialize():
-        return rag
-    return None
+    rag.initialize_in_background()
+    return rag
+
+
+def show_answer(query, result):
+    """Save an answer to the history and display it with its sources"""
+    if "messages" not in st.session_state:
+        st.session_state.messages = []
+    
+    st.session_state.messages.append({
+        "question": query,
+        "answer": result["answer"],
+        "sources": result["sources"]
+    })
+    
+    # Display latest answer
+    st.subheader("💡 Risposta")
+    st.success(result["answer"])
+    
+    # Display sources
+    st.subheader("📚 Fonti")
+    for i, source in enumerate(result["sources"], 1):
+        with st.expander(f"📄 {i}. {source['filename']}"):
+            st.text(source['content'])
+
+
+def show_search_results(rag, found, model_name):
+    """Ranked passages with highlights, pagination and on-demand answer"""
+    st.subheader(f"🔎 {found['total']} passaggi trovati")
+    st.caption(f"⚡ {found['seconds'] * 1000:.0f} ms — pagina {found['page']} di {found['pages']}")
+    
+    for r in found["results"]:
+        where = f" — pag. {r['page']}" if r["page"] else ""
+        with st.expander(f"#{r['rank']} 📄 {r['filename']}{where}", expanded=r["rank"] <= 3):
+            st.markdown(r["snippet"])
+            st.caption(f"{r['source']} · distanza {r['distance']:.3f}")
+    
+    col_prev, col_next, col_gen = st.columns([1, 1, 2])
+    with col_prev:
+        if st.button("⬅️ Precedenti", disabled=found["page"] <= 1, use_container_width=True):
+            st.session_state.search_page -= 1
+            st.rerun()
+    with col_next:
+        if st.button("Successivi ➡️", disabled=found["page"] >= found["pages"], use_container_width=True):
+            st.session_state.search_page += 1
+            st.rerun()
+    with col_gen:
+        generate = st.button("💡 Genera risposta da questi passaggi", use_container_width=True)
+    
+    if generate and found["results"]:
+        with st.spinner("🤔 Il modello sta pensando..."):
+            try:
+                result = rag.answer_from_results(found["query"], found["results"], model_name=model_name)
+                show_answer(found["query"], result)
+            except Exception as e:
+                st.error(f"❌ Errore: {str(e)}")
 
 
 def main():
@@ -147,6 +214,17 @@ def main():
         </div>
         """, unsafe_allow_html=True)
         
+        # Modelli già in memoria in Ollama (/api/ps): i "freddi" pagano il caricamento
+        loaded = {m.get("name", "").split(":latest")[0] for m in cached_loaded_models()}
+        if model_name in loaded:
+            st.caption(f"🔥 {model_name} caricato in memoria")
+        else:
+            st.caption(f"❄️ {model_name} non caricato: la prima risposta sarà più lenta")
+            # Con il motore già avviato il modello scelto viene precaricato subito
+            if "rag" in st.session_state and st.session_state.get("warming") != model_name:
+                st.session_state.warming = model_name
+                st.session_state.rag.warmup([model_name], embeddings=False)
+        
         # Documents path
         st.subheader("📁 Cartella Documenti")
         docs_path = st.text_input(
@@ -186,12 +264,59 @@ def main():
                     pdf_count = len([f for f in files if f.suffix == '.pdf'])
                     docx_count = len([f for f in files if f.suffix in ['.docx', '.doc']])
                     txt_count = len([f for f in files if f.suffix == '.txt'])
-                    st.info(f"📊 Trovati: {pdf_count} PDF, {docx_count} DOCX, {txt_count} TXT")
+                    archive_count = len([f for f in files if archive_extension(f.name)])
+                    st.info(f"📊 Trovati: {pdf_count} PDF, {docx_count} DOCX, {txt_count} TXT, "
+                            f"{archive_count} archivi/mail")
                 except:
                     pass
             else:
                 st.warning(f"⚠️ Cartella non trovata: {docs_path}")
         
+        per_subfolder = st.checkbox(
+            "🗂️ Una collection per sottocartella",
+            help="Indicizza ogni sottocartella in una collection separata: "
+                 "puoi interrogarle insieme o ricostruirne una sola"
+        )
+        shard_by = "subfolder" if per_subfolder else "root"
+        
+        # Metriche della pipeline (motore condiviso, se già avviato)
+        if "rag" in st.session_state:
+            with st.expander("📈 Metriche pipeline"):
+                snapshot = st.session_state.rag.metrics.snapshot()
+                rows = [
+                    {
+                        "Fase": stage,
+                        "Chiamate": data["count"],
+                        "Media (s)": round(data["avg_seconds"], 3),
+                        "Max (s)": round(data["max_seconds"], 3),
+                        "Elementi": data["items"],
+                        "Byte": data["bytes"]
+                    }
+                    for stage, data in sorted(snapshot["stages"].items())
+                ]
+                if rows:
+                    st.table(rows)
+                else:
+                    st.caption("Nessuna metrica ancora")
+                
+                memory = st.session_state.rag.memory.report()
+                mb = lambda n: f"{(n or 0) / 1024 / 1024:.0f} MB"
+                st.caption(
+                    f"🧠 Memoria: {mb(memory['rss'])} (picco {mb(memory['peak'])}"
+                    + (f", budget {mb(memory['budget'])}" if memory['budget'] else "")
+                    + f"), su disco {mb(memory['spilled_bytes'])} — picchi: "
+                    + ", ".join(f"{stage} {mb(peak)}" for stage, peak in sorted(memory['stages'].items()))
+                )
+                
+                queues = st.session_state.rag.scheduler.report()
+                st.caption(
+                    f"🚦 Coda Ollama — query: {queues['interactive']['queued']} in attesa "
+                    f"(media {queues['interactive']['avg_wait_seconds']:.2f}s), "
+                    f"indicizzazione: {queues['background']['queued']} in attesa "
+                    f"(media {queues['background']['avg_wait_seconds']:.2f}s, "
+                    f"rallentata {queues['background']['throttled']} volte)"
+                )
+        
         st.divider()
         
         # Info
@@ -234,26 +359,83 @@ def main():
             st.error(f"⚠️ Cartella '{docs_path}' non trovata!")
             return
         
-        with st.spinner(f"🔄 Inizializzazione con {selected_model}..."):
-            try:
-                rag = init_rag(docs_path, model_name)
-                
-                if rag:
-                    st.session_state.rag = rag
-                    st.session_state.model_name = model_name
-                    st.success(f"✅ Sistema pronto con {selected_model}!")
-                    st.balloons()
-                else:
-                    st.error("❌ Errore nell'inizializzazione")
-            except Exception as e:
-                st.error(f"❌ Errore: {str(e)}")
+        try:
+            rag = get_engine(docs_path, shard_by)
+            
+            # Un tentativo fallito resta in cache: lo rilanciamo
+            if rag.error and not rag.initializing:
+                rag.initialize_in_background()
+            
+            st.session_state.rag = rag
+        except Exception as e:
+            st.error(f"❌ Errore: {str(e)}")
+    
+    # Initialization progress (indicizzazione in background)
+    rag = st.session_state.get("rag")
+    
+    if rag is not None:
+        if rag.initializing:
+            progress = rag.progress
+            fraction = progress['done'] / progress['total'] if progress['total'] else 0.0
+            st.progress(
+                min(fraction, 1.0),
+                text=f"{progress['stage']} — {progress['done']}/{progress['total']}"
+            )
+            if rag.shards:
+                st.info("⏳ Indicizzazione in corso: puoi già interrogare i documenti indicizzati finora")
+        elif rag.error:
+            st.error(f"❌ Errore nell'inizializzazione: {rag.error}")
+        elif rag.ready:
+            st.success(f"✅ Sistema pronto! ({len(rag.shards)} collection)")
     
     st.divider()
     
     # Query interface
-    if "rag" in st.session_state:
+    if rag is not None and rag.qa_chain is not None and rag.shards:
         st.subheader(f"💬 Chatta con i tuoi documenti")
-        st.caption(f"🤖 Usando: {st.session_state.model_name}")
+        st.caption(f"🤖 Usando: {model_name}")
+        
+        # Shard selection
+        shard_names = list(rag.shards)
+        selected_shards = None
+        if len(shard_names) > 1:
+            selected_shards = st.multiselect(
+                "🗂️ Collection da interrogare",
+                options=shard_names,
+                default=shard_names
+            )
+            col_update, col_rebuild = st.columns(2)
+            with col_update:
+                if st.button("🔄 Aggiorna collection selezionate", disabled=rag.initializing,
+                             help="Solo file nuovi, modificati o rimossi"):
+                    with st.spinner("🔄 Aggiornamento..."):
+                        for name in selected_shards:
+                            rag.update_shard(name)
+                    st.success("✅ Collection aggiornate!")
+            with col_rebuild:
+                if st.button("🔁 Ricostruisci collection selezionate", disabled=rag.initializing,
+                             help="Da zero: serve dopo aver cambiato il chunking"):
+                    with st.spinner("🔄 Reindicizzazione..."):
+                        for name in selected_shards:
+                            rag.index_shard(name, incremental=False)
+                    st.success("✅ Collection ricostruite!")
+        
+        mode = st.radio(
+            "Modalità",
+            options=["💬 Risposta", "🔎 Solo ricerca"],
+            horizontal=True,
+            help="Solo ricerca: passaggi ordinati per pertinenza, senza LLM (istantaneo)"
+        )
+        search_only = mode == "🔎 Solo ricerca"
+        
+        conversational = False
+        if not search_only:
+            conversational = st.checkbox(
+                "🧵 Conversazione (domande di follow-up)",
+                value=True,
+                help="Le domande successive tengono conto delle precedenti e "
+                     "riusano il contesto già recuperato: risposte più rapide"
+            )
         
         # Query input
         query = st.text_area(
@@ -265,38 +447,55 @@ def main():
         col1, col2 = st.columns([3, 1])
         
         with col1:
-            search_button = st.button("🔍 Cerca Risposta", type="primary", use_container_width=True)
+            search_button = st.button(
+                "🔎 Cerca Passaggi" if search_only else "🔍 Cerca Risposta",
+                type="primary",
+                use_container_width=True
+            )
         
         with col2:
             if st.button("🗑️ Reset Chat", use_container_width=True):
                 if "messages" in st.session_state:
                     st.session_state.messages = []
+                st.session_state.pop("conversation_id", None)
                 st.rerun()
         
-        if search_button and query:
+        if search_only:
+            # La ricerca resta attiva tra i rerun (paginazione, genera risposta)
+            if search_button and query:
+                st.session_state.search_query = query
+                st.session_state.search_page = 1
+            
+            if st.session_state.get("search_query"):
+                try:
+                    found = rag.search(
+                        st.session_state.search_query,
+                        page=st.session_state.search_page,
+                        shards=selected_shards
+                    )
+                    show_search_results(rag, found, model_name)
+                except Exception as e:
+                    st.error(f"❌ Errore: {str(e)}")
+        
+        elif search_button and query:
             with st.spinner("🤔 Il modello sta pensando..."):
                 try:
-                    result = st.session_state.rag.query(query)
-                    
-                    # Save to history
-                    if "messages" not in st.session_state:
-                        st.session_state.messages = []
-                    
-                    st.session_state.messages.append({
-                        "question": query,
-                        "answer": result["answer"],
-                        "sources": result["sources"]
-                    })
-                    
-                    # Display latest answer
-                    st.subheader("💡 Risposta")
-                    st.success(result["answer"])
-                    
-                    # Display sources
-                    st.subheader("📚 Fonti")
-                    for i, source in enumerate(result["sources"], 1):
-                        with st.expander(f"📄 {i}. {source['filename']}"):
-                            st.text(source['content'])
+                    if conversational:
+                        if st.session_state.get("conversation_id") not in rag.conversations:
+                            st.session_state.conversation_id = rag.start_conversation()
+                        result = rag.chat(
+                            query,
+                            st.session_state.conversation_id,
+                            shards=selected_shards,
+                            model_name=model_name
+                        )
+                        if result["standalone_question"] != query:
+                            st.caption(f"🔁 Interpretata come: {result['standalone_question']}")
+                        if result["reused_context"]:
+                            st.caption("♻️ Contesto riusato dalla domanda precedente")
+                    else:
+                        result = rag.query(query, shards=selected_shards, model_name=model_name)
+                    show_answer(query, result)
                 
                 except Exception as e:
                     st.error(f"❌ Errore: {str(e)}")
@@ -334,6 +533,11 @@ def main():
         <p>💻 Progetto Portfolio per AI Engineering</p>
     </div>
     """, unsafe_allow_html=True)
+    
+    # Aggiorna la barra di avanzamento finché l'indicizzazione è in corso
+    if rag is not None and rag.initializing:
+        time.sleep(1)
+        st.rerun()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,246 @@
+"""
+Lettura di archivi e caselle di posta senza estrarli su disco
+ZIP, tar, .eml, .mbox e .msg: i membri vengono letti in memoria e passati
+ai loader dei documenti con sorgente "archivio::membro"
+"""
+
+import email
+import hashlib
+import io
+import re
+import tarfile
+import zipfile
+from email import policy
+from email.parser import BytesHeaderParser
+from html import unescape
+from pathlib import PurePosixPath
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from langchain.schema import Document
+
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.eml', '.mbox', '.msg')
+
+# Separatore tra archivio e membro nella sorgente dei chunk
+MEMBER_SEPARATOR = "::"
+
+# Membri più grandi vengono saltati (restano in memoria durante il parsing)
+MAX_MEMBER_BYTES = 200 * 1024 * 1024
+
+# Archivi dentro archivi (allegati zip, zip di mail...) fino a questa profondità
+MAX_DEPTH = 3
+
+
+def archive_extension(name: str) -> Optional[str]:
+    """Archive/mailbox extension of a file name, None for ordinary files"""
+    lower = name.lower()
+    for extension in sorted(ARCHIVE_EXTENSIONS, key=len, reverse=True):
+        if lower.endswith(extension):
+            return extension
+    return None
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _zip_members(fileobj: BinaryIO) -> Iterator[Tuple[str, bytes]]:
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or info.file_size > MAX_MEMBER_BYTES:
+                continue
+            yield info.filename, archive.read(info)
+
+
+def _tar_members(fileobj: BinaryIO) -> Iterator[Tuple[str, bytes]]:
+    with tarfile.open(fileobj=fileobj, mode='r:*') as archive:
+        for info in archive:
+            if not info.isfile() or info.size > MAX_MEMBER_BYTES:
+                continue
+            yield info.name, archive.extractfile(info).read()
+
+
+def _html_to_text(html: str) -> str:
+    text = re.sub(r'(?is)<(script|style).*?</\1>', ' ', html)
+    text = re.sub(r'(?i)<br\s*/?>|</p>|</div>', '\n', text)
+    return unescape(re.sub(r'<[^>]+>', ' ', text))
+
+
+def _mail_header(sender, to, date, subject) -> str:
+    return f"Da: {sender or ''}\nA: {to or ''}\nData: {date or ''}\nOggetto: {subject or ''}\n\n"
+
+
+def _eml_members(fileobj: BinaryIO) -> Iterator[Tuple[str, bytes]]:
+    """Message body (with headers) as messaggio.txt, then each attachment"""
+    message = email.message_from_binary_file(fileobj, policy=policy.default)
+
+    body = message.get_body(preferencelist=('plain', 'html'))
+    text = ''
+    if body is not None:
+        text = body.get_content()
+        if body.get_content_type() == 'text/html':
+            text = _html_to_text(text)
+
+    header = _mail_header(message['from'], message['to'], message['date'], message['subject'])
+    yield "messaggio.txt", (header + text).encode('utf-8')
+
+    for i, part in enumerate(message.iter_attachments(), 1):
+        payload = part.get_payload(decode=True)
+        if payload and len(payload) <= MAX_MEMBER_BYTES:
+            yield part.get_filename() or f"allegato-{i}", payload
+
+
+def _mbox_message(lines: List[bytes], seen: set) -> Optional[Tuple[str, bytes]]:
+    """(name, bytes) of one mbox message, keyed on Message-ID or content hash"""
+    message = b''.join(lines)
+    if not message.strip():
+        return None
+    message_id = BytesHeaderParser().parsebytes(message).get('Message-ID') or ''
+    # Chiave stabile: non cambia se si aggiungono o tolgono messaggi prima
+    key = re.sub(r'[^\w.@-]+', '_', str(message_id).strip('<> \t'))[:120] or content_hash(message)[:16]
+    base, n = key, 1
+    while key in seen:  # Message-ID duplicato
+        n += 1
+        key = f"{base}-{n}"
+    seen.add(key)
+    return f"messaggio-{key}.eml", message
+
+
+def _mbox_members(fileobj: BinaryIO) -> Iterator[Tuple[str, bytes]]:
+    """One .eml member per message, read line by line (split on 'From ' lines)"""
+    lines, size, seen = [], 0, set()
+    for line in fileobj:
+        if line.startswith(b'From '):
+            member = _mbox_message(lines, seen)
+            if member:
+                yield member
+            lines, size = [], 0
+            continue
+        size += len(line)
+        if size > MAX_MEMBER_BYTES:
+            continue  # messaggio troppo grande: si tiene solo l'inizio
+        # ">From " è l'escape mboxrd di una riga "From " nel corpo
+        lines.append(re.sub(rb'^>(>*From )', rb'\1', line))
+
+    member = _mbox_message(lines, seen)
+    if member:
+        yield member
+
+
+def _msg_members(fileobj: BinaryIO) -> Iterator[Tuple[str, bytes]]:
+    """Outlook .msg via the optional extract_msg package"""
+    try:
+        import extract_msg
+    except ImportError:
+        raise ImportError("per i file .msg installa extract_msg (pip install extract-msg)")
+
+    message = extract_msg.Message(fileobj.read())
+    try:
+        header = _mail_header(message.sender, message.to, message.date, message.subject)
+        yield "messaggio.txt", (header + (message.body or '')).encode('utf-8')
+
+        for i, attachment in enumerate(message.attachments, 1):
+            payload = attachment.data
+            if isinstance(payload, bytes) and len(payload) <= MAX_MEMBER_BYTES:
+                name = attachment.longFilename or attachment.shortFilename or f"allegato-{i}"
+                yield name, payload
+    finally:
+        message.close()
+
+
+_READERS = {
+    '.zip': _zip_members,
+    '.tar': _tar_members,
+    '.tar.gz': _tar_members,
+    '.tgz': _tar_members,
+    '.tar.bz2': _tar_members,
+    '.tbz2': _tar_members,
+    '.eml': _eml_members,
+    '.mbox': _mbox_members,
+    '.msg': _msg_members,
+}
+
+
+def iter_members(
+    source: str,
+    fileobj: BinaryIO,
+    extensions: Tuple[str, ...],
+    depth: int = 0
+) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yield (source, bytes) for every member with a wanted extension
+
+    fileobj is the open archive (the file on disk for the outer one, a
+    BytesIO for nested ones). Nested archives and mail attachments are
+    opened recursively; the source chains names as
+    "archivio.zip::mail.eml::allegato.pdf".
+    """
+    reader = _READERS[archive_extension(source.rsplit(MEMBER_SEPARATOR, 1)[-1])]
+
+    for name, member in reader(fileobj):
+        member_source = f"{source}{MEMBER_SEPARATOR}{name}"
+
+        if archive_extension(name) and depth < MAX_DEPTH:
+            # Un membro rotto non deve fermare il resto dell'archivio (es. mbox)
+            try:
+                yield from iter_members(member_source, io.BytesIO(member), extensions, depth + 1)
+            except Exception as e:
+                print(f"❌ Error reading {member_source}: {str(e)}")
+        elif PurePosixPath(name).suffix.lower() in extensions:
+            yield member_source, member
+
+
+def member_filename(source: str) -> str:
+    """Display name of an archive member (last path component)"""
+    return PurePosixPath(source.rsplit(MEMBER_SEPARATOR, 1)[-1]).name
+
+
+def load_pdf_bytes(data: bytes) -> List[Document]:
+    """One Document per page, like PyPDFLoader (0-based 'page')"""
+    from pypdf import PdfReader
+
+    reader = PdfReader(io.BytesIO(data))
+    return [
+        Document(page_content=page.extract_text() or '', metadata={'page': i})
+        for i, page in enumerate(reader.pages)
+    ]
+
+
+def load_text_bytes(data: bytes) -> List[Document]:
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError:
+        text = data.decode('latin-1')
+    return [Document(page_content=text, metadata={})]
+
+
+def load_word_bytes(data: bytes, extension: str, elements: bool = False) -> List[Document]:
+    """Word file through unstructured, optionally one Document per element"""
+    if extension == '.doc':
+        from unstructured.partition.doc import partition_doc as partition
+    else:
+        from unstructured.partition.docx import partition_docx as partition
+
+    parts = partition(file=io.BytesIO(data))
+    if not elements:
+        return [Document(page_content="\n\n".join(str(p) for p in parts), metadata={})]
+
+    documents = []
+    for part in parts:
+        metadata = part.metadata.to_dict()
+        metadata['category'] = part.category
+        documents.append(Document(page_content=str(part), metadata=metadata))
+    return documents
+
+
+def load_bytes(source: str, data: bytes, elements: bool = False) -> List[Document]:
+    """Parse an in-memory member with the loader matching its extension"""
+    extension = PurePosixPath(source.rsplit(MEMBER_SEPARATOR, 1)[-1]).suffix.lower()
+
+    if extension == '.pdf':
+        return load_pdf_bytes(data)
+    if extension == '.txt':
+        return load_text_bytes(data)
+    if extension in ('.docx', '.doc'):
+        return load_word_bytes(data, extension, elements)
+    raise ValueError(f"Formato non supportato: {extension}")
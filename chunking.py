@@ -0,0 +1,247 @@
+"""
+Chunking adattivo per formato
+Strategie di split diverse per PDF, DOCX e TXT, con lunghezza misurata in token
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+
+# Dimensioni in TOKEN (non caratteri): ~300 token ≈ 1200 caratteri in italiano
+#   page      -> una pagina PDF resta intera fino a page_size token; oltre si
+#                spezza in chunk_size con overlap (k=3 pagine intere ~1500 token
+#                stanno nel contesto del modello insieme a domanda e risposta)
+#   heading   -> DOCX raggruppato per titoli/sezioni prima dello split
+#   recursive -> split classico (note TXT: chunk più grandi, overlap minimo)
+DEFAULT_CHUNKING = {
+    '.pdf': {'strategy': 'page', 'chunk_size': 300, 'chunk_overlap': 30, 'min_chunk_size': 60,
+             'page_size': 500},
+    '.docx': {'strategy': 'heading', 'chunk_size': 300, 'chunk_overlap': 30, 'min_chunk_size': 60},
+    '.doc': {'strategy': 'heading', 'chunk_size': 300, 'chunk_overlap': 30, 'min_chunk_size': 60},
+    '.txt': {'strategy': 'recursive', 'chunk_size': 400, 'chunk_overlap': 20, 'min_chunk_size': 80},
+    'default': {'strategy': 'recursive', 'chunk_size': 300, 'chunk_overlap': 30, 'min_chunk_size': 60},
+}
+
+STRATEGIES = ('page', 'heading', 'recursive')
+
+SEPARATORS = ["\n\n", "\n", ". ", "; ", ", ", " ", ""]
+
+# Metadati propri di ogni elemento di unstructured: non passano alla sezione
+ELEMENT_METADATA_KEYS = {
+    'category', 'category_depth', 'element_id', 'parent_id', 'page_number', 'page_name',
+    'languages', 'filetype', 'file_directory', 'last_modified', 'coordinates',
+    'emphasized_text_contents', 'emphasized_text_tags', 'text_as_html', 'link_urls',
+    'link_texts', 'links', 'header_footer_type', 'detection_class_prob', 'orig_elements',
+}
+
+
+def token_length_function() -> Callable[[str], int]:
+    """Return a token counter (tiktoken), falling back to ~4 chars per token offline"""
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        # tiktoken scarica il vocabolario al primo uso: offline usiamo una stima
+        return lambda text: max(1, len(text) // 4) if text else 0
+
+
+def resolve_chunking(overrides: Optional[Dict] = None) -> Dict:
+    """Merge per-extension overrides on top of DEFAULT_CHUNKING"""
+    config = {ext: dict(params) for ext, params in DEFAULT_CHUNKING.items()}
+
+    for ext, params in (overrides or {}).items():
+        ext = ext.lower()
+        base = config.get(ext, config['default'])
+        config[ext] = {**base, **params}
+
+    for ext, params in config.items():
+        if params['strategy'] not in STRATEGIES:
+            raise ValueError(f"Strategia di chunking sconosciuta per {ext}: {params['strategy']} "
+                             f"(valide: {', '.join(STRATEGIES)})")
+
+    return config
+
+
+def group_by_heading(elements: List[Document]) -> List[Document]:
+    """
+    Group unstructured elements (mode="elements") into one document per section
+
+    A new section starts at every element with category 'Title'. Documents
+    loaded in "single" mode have no category and pass through unchanged.
+    """
+    sections = []
+    current = None
+
+    for element in elements:
+        category = element.metadata.get('category')
+
+        if category is None:
+            sections.append(element)
+            current = None
+            continue
+
+        if current is None or category == 'Title' or \
+                element.metadata.get('source') != current.metadata.get('source'):
+            # Metadati del sorgente (content_hash, archive...) sì, quelli dell'elemento no
+            metadata = {
+                key: value for key, value in element.metadata.items()
+                if key not in ELEMENT_METADATA_KEYS
+                and isinstance(value, (str, int, float, bool))
+            }
+            metadata.update({
+                'source': element.metadata.get('source', ''),
+                'filename': element.metadata.get('filename', ''),
+                'section': element.page_content.strip()[:200] if category == 'Title' else '',
+            })
+            current = Document(page_content=element.page_content, metadata=metadata)
+            sections.append(current)
+        else:
+            current.page_content += "\n\n" + element.page_content
+
+    return sections
+
+
+def _split_one(
+    doc: Document,
+    splitter: RecursiveCharacterTextSplitter,
+    length_function: Callable[[str], int],
+    min_chunk_size: int,
+    page_size: int = 0
+) -> Tuple[List[Document], int]:
+    """Split a single document, merge a tiny trailing fragment, count overlap bytes"""
+    text = doc.page_content
+    if not text.strip():
+        return [], 0
+    if page_size and length_function(text) <= page_size:
+        # Strategia 'page': la pagina intera è un solo chunk
+        return [Document(page_content=text, metadata={**doc.metadata, 'start_index': 0})], 0
+
+    chunks = splitter.split_documents([doc])
+
+    # Un frammento finale minuscolo viene accorpato al chunk precedente
+    if len(chunks) > 1 and length_function(chunks[-1].page_content) < min_chunk_size:
+        last = chunks.pop()
+        prev = chunks[-1]
+        start = prev.metadata['start_index']
+        end = last.metadata['start_index'] + len(last.page_content)
+        prev.page_content = text[start:end]
+
+    overlap_bytes = 0
+    for prev, cur in zip(chunks, chunks[1:]):
+        prev_start = prev.metadata['start_index']
+        prev_end = prev_start + len(prev.page_content)
+        cur_start = cur.metadata['start_index']
+        if cur_start < prev_end:
+            overlap_bytes += len(text[cur_start:prev_end].encode('utf-8'))
+
+    return chunks, overlap_bytes
+
+
+def split_documents(
+    documents: List[Document],
+    chunking: Optional[Dict] = None
+) -> Tuple[List[Document], Dict]:
+    """
+    Split documents with the strategy configured for their extension
+
+    Args:
+        documents: Loaded documents (metadata 'source' decides the extension)
+        chunking: Resolved config from resolve_chunking() (default if None)
+
+    Returns:
+        (chunks, stats) where stats has per-extension and total counters
+    """
+    config = chunking or resolve_chunking()
+    length_function = token_length_function()
+
+    by_extension = {}
+    for doc in documents:
+        # Pagine vuote (scansioni senza OCR): nessun chunk, come lo splitter
+        if not doc.page_content.strip():
+            continue
+        source = doc.metadata.get('source', '')
+        extension = '.' + source.rsplit('.', 1)[-1].lower() if '.' in source else ''
+        by_extension.setdefault(extension, []).append(doc)
+
+    chunks = []
+    stats = {'by_extension': {}, 'total': {}}
+
+    for extension, docs in by_extension.items():
+        params = config.get(extension, config['default'])
+
+        if params['strategy'] == 'heading':
+            docs = group_by_heading(docs)
+
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=params['chunk_size'],
+            chunk_overlap=params['chunk_overlap'],
+            length_function=length_function,
+            separators=SEPARATORS,
+            add_start_index=True
+        )
+
+        page_size = 0
+        if params['strategy'] == 'page':
+            page_size = params.get('page_size', params['chunk_size'])
+
+        ext_chunks = []
+        overlap_bytes = 0
+        for doc in docs:
+            doc_chunks, doc_overlap = _split_one(
+                doc, splitter, length_function, params['min_chunk_size'], page_size
+            )
+            ext_chunks.extend(doc_chunks)
+            overlap_bytes += doc_overlap
+
+        tokens = sum(length_function(c.page_content) for c in ext_chunks)
+        chars = sum(len(c.page_content) for c in ext_chunks)
+
+        stats['by_extension'][extension or '(none)'] = {
+            'strategy': params['strategy'],
+            'documents': len(docs),
+            'chunks': len(ext_chunks),
+            'tokens': tokens,
+            'avg_tokens': tokens / len(ext_chunks) if ext_chunks else 0,
+            'avg_chars': chars / len(ext_chunks) if ext_chunks else 0,
+            'overlap_bytes': overlap_bytes,
+        }
+        chunks.extend(ext_chunks)
+
+    total_chunks = len(chunks)
+    total_tokens = sum(s['tokens'] for s in stats['by_extension'].values())
+    stats['total'] = {
+        'chunks': total_chunks,
+        'tokens': total_tokens,
+        'avg_tokens': total_tokens / total_chunks if total_chunks else 0,
+        'overlap_bytes': sum(s['overlap_bytes'] for s in stats['by_extension'].values()),
+        'bytes': sum(len(c.page_content.encode('utf-8')) for c in chunks),
+    }
+
+    return chunks, stats
+
+
+def merge_stats(first: Dict, second: Dict) -> Dict:
+    """Combine the stats of two split_documents() calls (documents split in slices)"""
+    if not first:
+        return second
+
+    by_extension = {ext: dict(data) for ext, data in first['by_extension'].items()}
+    for ext, data in second['by_extension'].items():
+        current = by_extension.setdefault(ext, {**data, 'documents': 0, 'chunks': 0, 'tokens': 0,
+                                                'avg_chars': 0, 'overlap_bytes': 0})
+        chunks = current['chunks'] + data['chunks']
+        current['avg_chars'] = (
+            (current['avg_chars'] * current['chunks'] + data['avg_chars'] * data['chunks']) / chunks
+            if chunks else 0
+        )
+        for key in ('documents', 'chunks', 'tokens', 'overlap_bytes'):
+            current[key] += data[key]
+        current['avg_tokens'] = current['tokens'] / chunks if chunks else 0
+
+    total = {key: first['total'][key] + second['total'][key]
+             for key in ('chunks', 'tokens', 'overlap_bytes', 'bytes')}
+    total['avg_tokens'] = total['tokens'] / total['chunks'] if total['chunks'] else 0
+    return {'by_extension': by_extension, 'total': total}
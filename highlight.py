@@ -0,0 +1,67 @@
+"""
+Evidenziazione dei termini cercati nei passaggi trovati
+"""
+
+import re
+from typing import List, Tuple
+
+
+# Parole troppo comuni per essere evidenziate (italiano + inglese)
+STOPWORDS = {
+    'che', 'chi', 'con', 'per', 'tra', 'fra', 'del', 'della', 'dello', 'dei', 'degli',
+    'delle', 'dal', 'dalla', 'nel', 'nella', 'nei', 'nelle', 'sul', 'sulla', 'una',
+    'uno', 'gli', 'le', 'non', 'sono', 'come', 'cosa', 'quali', 'quale', 'quando',
+    'dove', 'anche', 'più', 'the', 'and', 'for', 'with', 'what', 'which', 'who',
+    'are', 'was', 'from', 'that', 'this'
+}
+
+
+def query_terms(question: str, min_length: int = 3) -> List[str]:
+    """Distinct significant words of a question, longest first"""
+    words = re.findall(r'\w+', question.lower())
+    terms = {w for w in words if len(w) >= min_length and w not in STOPWORDS}
+    return sorted(terms, key=len, reverse=True)
+
+
+def highlight_spans(text: str, terms: List[str]) -> List[Tuple[int, int]]:
+    """(start, end) character spans of term matches, merged and sorted"""
+    if not terms:
+        return []
+
+    pattern = re.compile('|'.join(re.escape(t) for t in terms), re.IGNORECASE)
+    spans = []
+    for match in pattern.finditer(text):
+        start, end = match.span()
+        if spans and start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], max(end, spans[-1][1]))
+        else:
+            spans.append((start, end))
+    return spans
+
+
+def make_snippet(
+    text: str,
+    spans: List[Tuple[int, int]],
+    width: int = 300,
+    marker: str = "**"
+) -> str:
+    """Window of text around the first match with matches wrapped in marker"""
+    if spans:
+        start = max(0, spans[0][0] - width // 3)
+    else:
+        start = 0
+    end = min(len(text), start + width)
+
+    parts = []
+    cursor = start
+    for span_start, span_end in spans:
+        if span_end <= start or span_start >= end:
+            continue
+        span_start, span_end = max(span_start, start), min(span_end, end)
+        parts.append(text[cursor:span_start])
+        parts.append(f"{marker}{text[span_start:span_end]}{marker}")
+        cursor = span_end
+    parts.append(text[cursor:end])
+
+    snippet = ''.join(parts).replace("\n", " ")
+    return ("…" if start > 0 else "") + snippet + ("…" if end < len(text) else "")
@@ -0,0 +1,268 @@
+"""
+Budget di memoria per indicizzazione e query
+Misura la RSS del processo, riduce parallelismo e batch quando si avvicina
+al budget e sposta su disco i documenti in attesa di embedding
+"""
+
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from langchain.schema import Document
+
+try:
+    import psutil
+except ImportError:  # opzionale: senza psutil si legge /proc (Linux) o resource
+    psutil = None
+
+
+# Buffer in memoria dei documenti in attesa: minimo e massimo
+MIN_BUFFER_BYTES = 8 * 1024 * 1024
+MAX_BUFFER_BYTES = 256 * 1024 * 1024
+
+_UNITS = {'': 1, 'b': 1, 'k': 1024, 'kb': 1024, 'm': 1024 ** 2, 'mb': 1024 ** 2,
+          'g': 1024 ** 3, 'gb': 1024 ** 3}
+
+
+def parse_size(value: Union[int, str, None]) -> Optional[int]:
+    """Bytes from an int or a string like "2GB" / "512m" (None stays None)"""
+    if value is None or isinstance(value, int):
+        return value
+    match = re.fullmatch(r'\s*([\d.]+)\s*([a-zA-Z]*)\s*', str(value))
+    if not match or match.group(2).lower() not in _UNITS:
+        raise ValueError(f"Dimensione non valida: {value}")
+    return int(float(match.group(1)) * _UNITS[match.group(2).lower()])
+
+
+def current_rss() -> int:
+    """Resident memory of this process in bytes"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    # Ultima risorsa: picco (non valore attuale); KB su Linux, byte su macOS
+    try:
+        import resource
+    except ImportError:  # Windows senza psutil: nessuna misura
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def available_memory() -> Optional[int]:
+    """Memory the OS can still give out without swapping (None if unknown)"""
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class MemoryGovernor:
+    """
+    Tracks RSS against a budget and scales ingestion to stay under it
+
+    Pressure is the highest of RSS / budget and min_available / free system
+    memory (Ollama and Chroma live outside this process but share the RAM).
+    Above 0.85 parallelism and batch sizes are halved, above 1.0 quartered.
+    """
+
+    def __init__(
+        self,
+        budget: Union[int, str, None] = None,
+        min_available: Union[int, str, None] = "512MB",
+        interval: float = 0.25,
+        metrics: Optional[Any] = None
+    ):
+        """
+        Args:
+            budget: Max RSS for this process ("3GB", bytes; None = no limit)
+            min_available: Free system memory below which we back off
+            interval: Seconds between RSS samples
+            metrics: Optional PipelineMetrics for memory gauges
+        """
+        self.budget = parse_size(budget)
+        self.min_available = parse_size(min_available)
+        self.metrics = metrics
+        self.rss = current_rss()
+        self.available = available_memory()
+        self.peak = self.rss
+        self.stats = {'throttled': 0, 'spills': 0, 'spilled_bytes': 0}
+        self.peaks = {}  # fase -> picco RSS osservato durante la fase
+        self._active = {}  # fase -> picco in corso (fasi annidate o parallele)
+        self._lock = threading.Lock()
+
+        if self.metrics is not None and self.budget:
+            self.metrics.set_gauge('memory_budget_bytes', self.budget)
+
+        self._interval = interval
+        threading.Thread(target=self._sample_loop, daemon=True).start()
+
+    def _sample_loop(self):
+        while True:
+            self.sample()
+            time.sleep(self._interval)
+
+    def sample(self) -> int:
+        """Read RSS now and update peaks"""
+        rss = current_rss()
+        available = available_memory()
+        with self._lock:
+            self.rss = rss
+            self.available = available
+            self.peak = max(self.peak, rss)
+            for stage, peak in self._active.items():
+                self._active[stage] = max(peak, rss)
+        if self.metrics is not None:
+            self.metrics.set_gauge('memory_rss_bytes', rss)
+        return rss
+
+    @contextmanager
+    def stage(self, name: str):
+        """Record the peak RSS seen while the block runs as the stage's peak"""
+        rss = self.sample()
+        with self._lock:
+            self._active[name] = max(self._active.get(name, 0), rss)
+        try:
+            yield
+        finally:
+            rss = self.sample()
+            with self._lock:
+                peak = max(self._active.pop(name, rss), rss)
+                self.peaks[name] = max(self.peaks.get(name, 0), peak)
+                peak = self.peaks[name]
+            if self.metrics is not None:
+                self.metrics.set_gauge(f'memory_peak_{name}_bytes', peak)
+
+    def pressure(self) -> float:
+        """0 = plenty of room, 1 = at the budget (or at min_available free)"""
+        levels = []
+        if self.budget:
+            levels.append(self.rss / self.budget)
+        if self.min_available and self.available is not None:
+            levels.append(self.min_available / max(self.available, 1))
+        return max(levels, default=0.0)
+
+    def scale(self, value: int, minimum: int = 1) -> int:
+        """value reduced according to the current pressure"""
+        pressure = self.pressure()
+        if pressure < 0.85:
+            return value
+        with self._lock:
+            self.stats['throttled'] += 1
+        factor = 0.5 if pressure < 1.0 else 0.25
+        return max(minimum, int(value * factor))
+
+    def buffer_bytes(self) -> int:
+        """How many bytes of pending documents may stay in memory"""
+        if self.pressure() >= 1.0:
+            return MIN_BUFFER_BYTES
+        limit = MAX_BUFFER_BYTES
+        if self.budget:
+            limit = min(limit, (self.budget - self.rss) // 4)
+        if self.min_available and self.available is not None:
+            limit = min(limit, (self.available - self.min_available) // 4)
+        return max(MIN_BUFFER_BYTES, limit)
+
+    def record_spill(self, nbytes: int):
+        with self._lock:
+            self.stats['spills'] += 1
+            self.stats['spilled_bytes'] += nbytes
+            spilled = self.stats['spilled_bytes']
+        if self.metrics is not None:
+            self.metrics.set_gauge('memory_spilled_bytes', spilled)
+
+    def report(self) -> Dict:
+        """Budget, current and peak RSS, per-stage peaks and adaptation counters"""
+        with self._lock:
+            return {
+                'budget': self.budget,
+                'rss': self.rss,
+                'available': self.available,
+                'peak': self.peak,
+                'pressure': self.pressure(),
+                'stages': dict(self.peaks),
+                **self.stats
+            }
+
+
+class SpillBuffer:
+    """
+    Append-only list of Documents that moves to a temp file when too big
+
+    Iteration returns documents in insertion order (spilled ones first,
+    as they are the oldest). The in-memory limit comes from the governor.
+    """
+
+    def __init__(self, governor: MemoryGovernor, spill_dir: Optional[str] = None):
+        self.governor = governor
+        self.spill_dir = spill_dir
+        self._memory = []
+        self._memory_bytes = 0
+        self._spilled = 0
+        self._file = None
+
+    def append(self, doc: Document):
+        self._memory.append(doc)
+        # Stima: testo UTF-8 + metadati
+        self._memory_bytes += len(doc.page_content.encode('utf-8')) + 256
+        if self._memory_bytes > self.governor.buffer_bytes():
+            self._spill()
+
+    def extend(self, docs: List[Document]):
+        for doc in docs:
+            self.append(doc)
+
+    def _spill(self):
+        if self._file is None:
+            if self.spill_dir:
+                os.makedirs(self.spill_dir, exist_ok=True)
+            self._file = tempfile.TemporaryFile(dir=self.spill_dir)
+
+        self._file.seek(0, os.SEEK_END)
+        start = self._file.tell()
+        for doc in self._memory:
+            line = json.dumps({'page_content': doc.page_content, 'metadata': doc.metadata},
+                              ensure_ascii=False)
+            self._file.write((line + "\n").encode('utf-8'))
+        self.governor.record_spill(self._file.tell() - start)
+
+        self._spilled += len(self._memory)
+        self._memory = []
+        self._memory_bytes = 0
+
+    def __len__(self) -> int:
+        return self._spilled + len(self._memory)
+
+    def __iter__(self) -> Iterator[Document]:
+        # Posizione propria: append durante l'iterazione non la sposta
+        position = 0
+        while self._file is not None:
+            self._file.seek(position)
+            line = self._file.readline()
+            if not line:
+                break
+            position = self._file.tell()
+            data = json.loads(line)
+            yield Document(page_content=data['page_content'], metadata=data['metadata'])
+        yield from list(self._memory)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._memory = []
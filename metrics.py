@@ -0,0 +1,228 @@
+"""
+Metriche della pipeline RAG
+Durate, conteggi e byte per fase, esportabili in JSON e formato Prometheus
+"""
+
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema.embeddings import Embeddings
+
+
+# Oltre questo tempo di caricamento la richiesta è considerata a freddo
+COLD_LOAD_SECONDS = 0.5
+
+
+def _empty_stage() -> Dict:
+    return {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'items': 0, 'bytes': 0}
+
+
+class PipelineMetrics:
+    """Thread-safe per-stage timings plus a structured JSON event log"""
+
+    def __init__(self, log_path: Optional[str] = None, max_events: int = 1000):
+        """
+        Args:
+            log_path: Optional JSON-lines file, one event per recorded stage
+            max_events: Recent events kept in memory
+        """
+        self.log_path = log_path
+        self.stages = defaultdict(_empty_stage)
+        self.gauges = {}
+        self.events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def record(self, stage: str, seconds: float, items: int = 0, nbytes: int = 0, **fields):
+        """Record one occurrence of a stage (extra fields go to the event log)"""
+        event = {
+            'ts': round(time.time(), 3),
+            'stage': stage,
+            'seconds': round(seconds, 6),
+            'items': items,
+            'bytes': nbytes,
+            **fields
+        }
+
+        with self._lock:
+            data = self.stages[stage]
+            data['count'] += 1
+            data['seconds'] += seconds
+            data['max_seconds'] = max(data['max_seconds'], seconds)
+            data['items'] += items
+            data['bytes'] += nbytes
+            self.events.append(event)
+
+            if self.log_path:
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+
+    @contextmanager
+    def timer(self, stage: str, **fields):
+        """
+        Time a block; the yielded dict can set 'items', 'bytes' and extra fields
+
+            with metrics.timer('parse', file=name) as info:
+                info['items'] = len(pages)
+        """
+        info = dict(fields)
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            elapsed = time.perf_counter() - start
+            items = info.pop('items', 0)
+            nbytes = info.pop('bytes', 0)
+            self.record(stage, elapsed, items=items, nbytes=nbytes, **info)
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self.gauges[name] = value
+
+    def snapshot(self) -> Dict:
+        """Copy of all stage totals and gauges"""
+        with self._lock:
+            stages = {}
+            for stage, data in self.stages.items():
+                stages[stage] = {
+                    **data,
+                    'avg_seconds': data['seconds'] / data['count'] if data['count'] else 0.0
+                }
+            return {'stages': stages, 'gauges': dict(self.gauges)}
+
+    def recent_events(self, limit: int = 50) -> List[Dict]:
+        with self._lock:
+            return list(self.events)[-limit:]
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix: str = "rag") -> str:
+        """Prometheus text exposition format"""
+        snap = self.snapshot()
+        lines = []
+
+        series = [
+            ('stage_calls_total', 'counter', 'count'),
+            ('stage_seconds_total', 'counter', 'seconds'),
+            ('stage_seconds_max', 'gauge', 'max_seconds'),
+            ('stage_items_total', 'counter', 'items'),
+            ('stage_bytes_total', 'counter', 'bytes'),
+        ]
+        for name, kind, key in series:
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for stage, data in sorted(snap['stages'].items()):
+                lines.append(f'{prefix}_{name}{{stage="{stage}"}} {data[key]}')
+
+        for name, value in sorted(snap['gauges'].items()):
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = 9108, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serve /metrics (Prometheus) and /metrics.json in a daemon thread"""
+        metrics = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = metrics.to_prometheus(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = metrics.to_json(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                payload = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass  # niente log per ogni scrape
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+
+class TimedEmbeddings(Embeddings):
+    """Embeddings wrapper recording latency, batch size and bytes per call"""
+
+    def __init__(self, embeddings: Embeddings, metrics: PipelineMetrics):
+        self.embeddings = embeddings
+        self.metrics = metrics
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self.metrics.timer('embed_batch') as info:
+            info['items'] = len(texts)
+            info['bytes'] = sum(len(t.encode('utf-8')) for t in texts)
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self.metrics.timer('embed_query') as info:
+            info['items'] = 1
+            info['bytes'] = len(text.encode('utf-8'))
+            return self.embeddings.embed_query(text)
+
+
+class GenerationMetricsHandler(BaseCallbackHandler):
+    """Callback recording generation time, time-to-first-token and Ollama token counts"""
+
+    def __init__(self, metrics: PipelineMetrics):
+        self.metrics = metrics
+        self._runs = {}
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id, **kwargs):
+        self._runs[run_id] = {'start': time.perf_counter(), 'first_token': None}
+
+    def on_llm_new_token(self, token: str, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is not None and run['first_token'] is None:
+            run['first_token'] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+
+        elapsed = time.perf_counter() - run['start']
+        info = {}
+        for generations in response.generations:
+            for generation in generations:
+                info = generation.generation_info or info
+
+        # Ollama riporta i token nel chunk finale dello stream
+        prompt_tokens = info.get('prompt_eval_count', 0) or 0
+        completion_tokens = info.get('eval_count', 0) or 0
+
+        if run['first_token'] is not None:
+            self.metrics.record('llm_first_token', run['first_token'] - run['start'])
+
+        # Richiesta "fredda" se Ollama ha dovuto caricare il modello
+        load_seconds = (info.get('load_duration', 0) or 0) / 1e9
+        self.metrics.record('llm_load', load_seconds, model=info.get('model'))
+        self.metrics.record(
+            'llm_cold_start' if load_seconds > COLD_LOAD_SECONDS else 'llm_warm_start',
+            elapsed, model=info.get('model')
+        )
+        self.metrics.record(
+            'llm_prompt_eval', (info.get('prompt_eval_duration', 0) or 0) / 1e9,
+            items=prompt_tokens
+        )
+        self.metrics.record(
+            'llm_generation', elapsed,
+            items=completion_tokens,
+            model=info.get('model')
+        )
+
+    def on_llm_error(self, error: BaseException, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
@@ -0,0 +1,182 @@
+"""
+OCR per PDF scansionati
+Le pagine senza testo vanno a Tesseract in un pool di processi limitato,
+con cache su disco per hash del contenuto della pagina
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, List, Optional, Tuple, Union
+
+
+# Sotto questa soglia di caratteri la pagina è considerata solo immagine
+MIN_TEXT_CHARS = 20
+
+
+def is_image_only(text: str) -> bool:
+    """True if a page extracted by PyPDFLoader has (almost) no text"""
+    return len(text.strip()) < MIN_TEXT_CHARS
+
+
+def ocr_available() -> bool:
+    """Check for pytesseract + tesseract binary + a PDF rasterizer (PyMuPDF or pdf2image)"""
+    try:
+        import pytesseract  # noqa: F401
+    except ImportError:
+        return False
+
+    if shutil.which('tesseract') is None:
+        return False
+
+    for module in ('fitz', 'pdf2image'):
+        try:
+            __import__(module)
+            return True
+        except ImportError:
+            continue
+    return False
+
+
+def extract_pages(pdf: Union[str, BinaryIO], indexes: List[int]) -> List[bytes]:
+    """Write each requested page as a standalone single-page PDF (bytes)"""
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(pdf)
+    pages = []
+    for index in indexes:
+        writer = PdfWriter()
+        writer.add_page(reader.pages[index])
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        pages.append(buffer.getvalue())
+    return pages
+
+
+def _lower_priority():
+    """Worker initializer: OCR must not starve text-PDF parsing"""
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass  # Windows: nessun nice
+
+
+def _ocr_page(page_pdf: bytes, lang: str, dpi: int) -> Tuple[str, float]:
+    """Rasterize a single-page PDF and run Tesseract (runs in a worker process)"""
+    import pytesseract
+
+    start = time.perf_counter()
+    try:
+        import fitz  # PyMuPDF
+        from PIL import Image
+
+        with fitz.open(stream=page_pdf, filetype='pdf') as doc:
+            pixmap = doc[0].get_pixmap(dpi=dpi)
+            image = Image.open(io.BytesIO(pixmap.tobytes('png')))
+    except ImportError:
+        from pdf2image import convert_from_bytes
+        image = convert_from_bytes(page_pdf, dpi=dpi)[0]
+
+    text = pytesseract.image_to_string(image, lang=lang)
+    return text, time.perf_counter() - start
+
+
+class OCRPool:
+    """Bounded OCR process pool with a per-page cache keyed on content hash"""
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_workers: Optional[int] = None,
+        lang: str = "ita+eng",
+        dpi: int = 300
+    ):
+        """
+        Args:
+            cache_dir: Folder for cached OCR text (one file per page hash)
+            max_workers: OCR processes (default: half the CPUs, at least 1)
+            lang: Tesseract languages
+            dpi: Rasterization resolution
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        self.lang = lang
+        self.dpi = dpi
+        self.stats = {'pages': 0, 'cache_hits': 0, 'ocr_seconds': 0.0}
+        self._executor = None
+        self._pending = {}  # hash -> Future, la stessa pagina non va in OCR due volte
+        self._lock = threading.Lock()
+
+    def _cache_path(self, digest: str) -> Path:
+        return self.cache_dir / f"{digest}.txt"
+
+    def submit(self, page_pdf: bytes) -> Future:
+        """Queue a page for OCR; returns a Future resolving to its text"""
+        digest = hashlib.sha256(page_pdf).hexdigest()
+        cache_path = self._cache_path(digest)
+
+        with self._lock:
+            self.stats['pages'] += 1
+
+            if cache_path.exists():
+                self.stats['cache_hits'] += 1
+                future = Future()
+                future.set_result(cache_path.read_text(encoding='utf-8'))
+                return future
+
+            if digest in self._pending:
+                self.stats['cache_hits'] += 1
+                return self._pending[digest]
+
+            # Pool creato solo alla prima pagina scansionata
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    initializer=_lower_priority
+                )
+
+            result = Future()
+            self._pending[digest] = result
+            # Sotto lock: shutdown() non può chiudere il pool in mezzo
+            job = self._executor.submit(_ocr_page, page_pdf, self.lang, self.dpi)
+
+        job.add_done_callback(lambda done: self._finish(digest, done, result))
+        return result
+
+    def _finish(self, digest: str, job: Future, result: Future):
+        try:
+            text, seconds = job.result()
+        except Exception as e:
+            with self._lock:
+                self._pending.pop(digest, None)
+            result.set_exception(e)
+            return
+
+        # Prima la cache, poi via da _pending: nel frattempo chi chiede la
+        # stessa pagina trova il Future in attesa, mai un buco fra i due.
+        # Una cache non scrivibile (disco pieno, permessi) non blocca il testo
+        try:
+            cache_path = self._cache_path(digest)
+            partial = cache_path.with_suffix('.tmp')
+            partial.write_text(text, encoding='utf-8')
+            os.replace(partial, cache_path)
+        except Exception as e:
+            print(f"⚠️  Cache OCR non scritta ({digest[:12]}): {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.pop(digest, None)
+                self.stats['ocr_seconds'] += seconds
+            result.set_result(text)
+
+    def shutdown(self):
+        """Stop the OCR processes once queued pages are done (submit() starts a new pool)"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
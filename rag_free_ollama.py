@@ -3,11 +3,19 @@ RAG System 100% GRATUITO con Ollama
 Nessun costo, tutto locale sul tuo PC!
 """
 
+import hashlib
+import json
 import os
 import sys
+import threading
+import time
+import uuid
 import warnings
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 # Disabilita TUTTI i warning fastidiosi
 warnings.filterwarnings('ignore')
@@ -19,20 +27,72 @@ import io
 _stderr = sys.stderr
 sys.stderr = io.StringIO()
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import (
     PyPDFLoader,
     TextLoader,
     UnstructuredWordDocumentLoader
 )
+import chromadb
 from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import OllamaEmbeddings
 from langchain_community.llms import Ollama
-from langchain.chains import RetrievalQA
+from langchain.chains.question_answering import load_qa_chain
 from langchain.prompts import PromptTemplate
+from langchain.schema import Document
 from langchain.callbacks.manager import CallbackManager
 from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
 
+from archives import archive_extension, content_hash, iter_members, load_bytes, member_filename
+from chunking import merge_stats, resolve_chunking, split_documents, token_length_function
+from highlight import highlight_spans, make_snippet, query_terms
+from memory import MemoryGovernor, SpillBuffer
+from metrics import GenerationMetricsHandler, PipelineMetrics, TimedEmbeddings
+from ocr import OCRPool, extract_pages, is_image_only, ocr_available
+from scheduler import BACKGROUND, OllamaScheduler, ScheduledEmbeddings, ScheduledOllama
+from shards import EMBEDDING_MODEL, shard_layout
+from warmup import (
+    DEFAULT_KEEP_ALIVE,
+    KeepAliveOllamaEmbeddings,
+    is_loaded,
+    preload_embeddings,
+    preload_llm
+)
+
+
+# Loader per estensione (file sciolti); i membri degli archivi usano archives.load_bytes
+LOADERS = {
+    '.pdf': PyPDFLoader,
+    '.txt': TextLoader,
+    '.docx': UnstructuredWordDocumentLoader,
+    '.doc': UnstructuredWordDocumentLoader
+}
+
+# Prefisso fisso delle conversazioni: identico a ogni turno, così Ollama
+# riusa la cache del prompt (KV cache) invece di rielaborarlo da capo
+CHAT_PREFIX = """Sei un assistente che risponde a domande sui documenti dell'utente.
+Usa solo il contesto fornito. Se non conosci la risposta, di' semplicemente che non lo sai.
+Rispondi in italiano in modo chiaro e conciso.
+
+"""
+
+# Serializza le scritture di collections.json fra i motori di questo processo
+_MANIFEST_LOCK = threading.Lock()
+
+# Token riservati alla risposta nel contesto del modello (num_ctx)
+CHAT_ANSWER_TOKENS = 512
+
+# Va in coda a CHAT_PREFIX + transcript: la riformulazione condivide il
+# prefisso della risposta e non ne scarta la cache
+CONDENSE_TEMPLATE = """Nuova domanda di follow-up: {question}
+Riformulala come domanda autonoma, comprensibile senza la conversazione sopra,
+in italiano, su una sola riga.
+Domanda autonoma:"""
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = (sum(x * x for x in a) ** 0.5) * (sum(y * y for y in b) ** 0.5)
+    return dot / norm if norm else 0.0
+
 
 class FreeLocalRAG:
     """RAG completamente gratuito usando Ollama"""
@@ -41,7 +101,19 @@ class FreeLocalRAG:
         self, 
         documents_path: str,
         model_name: str = "llama3.2",  # Modello gratis da Ollama
-        persist_directory: str = "./chroma_db"
+        persist_directory: str = "./chroma_db",
+        chunking: Optional[Dict] = None,
+        collection_name: Optional[str] = None,
+        shard_by: str = "root",
+        metrics_log: Optional[str] = None,
+        ocr: bool = True,
+        ocr_workers: Optional[int] = None,
+        ollama_workers: int = 1,
+        parse_workers: Optional[int] = None,
+        memory_budget: Union[int, str, None] = None,
+        keep_alive: Union[int, str] = DEFAULT_KEEP_ALIVE,
+        preload: bool = True,
+        num_ctx: int = 4096
     ):
         """
         Initialize FREE RAG system
@@ -51,89 +123,659 @@ class FreeLocalRAG:
             model_name: Ollama model to use (default: llama3.2)
                        Altri modelli: mistral, phi3, llama3.1, qwen2.5
             persist_directory: Vector DB storage path
+            chunking: Per-extension chunking overrides, e.g.
+                      {'.pdf': {'chunk_size': 400, 'chunk_overlap': 0}}
+                      (vedi chunking.DEFAULT_CHUNKING)
+            collection_name: Collection name (default: derived from the folder)
+            shard_by: "root" = one collection for the whole folder,
+                      "subfolder" = one collection per top-level subfolder
+            metrics_log: Optional JSON-lines file for per-stage metric events
+            ocr: OCR image-only PDF pages with Tesseract (if installed)
+            ocr_workers: OCR processes (default: half the CPUs)
+            ollama_workers: Concurrent requests sent to Ollama by the scheduler
+            parse_workers: Threads parsing files and archive members
+                           (default: CPUs, at most 4)
+            memory_budget: Max RSS of this process ("3GB"); near it parse
+                           workers and embed batches shrink and pending
+                           documents spill to disk (None = only free RAM)
+            keep_alive: How long Ollama keeps the models loaded after the
+                        last request ("30m", "-1m" = forever, 0 = unload)
+            preload: Load LLM and embedding model in the background now,
+                     so the first question does not pay the load time
+            num_ctx: Context window requested from Ollama (tokens); chat
+                     transcripts are sized against it
         """
         self.documents_path = Path(documents_path)
         self.persist_directory = persist_directory
-        self.vectorstore = None
+        self.collection_name = collection_name
+        self.shard_by = shard_by
+        self.shards = {}  # nome collection -> Chroma
+        self.manifest_path = Path(persist_directory) / "collections.json"
         self.qa_chain = None
+        self.qa_chains = {}  # chain per modelli diversi da quello di default
+        self.llms = {}
+        self.conversations = OrderedDict()  # id -> stato della conversazione
+        self.reuse_threshold = 0.85  # similarità oltre la quale si riusa il contesto
+        self.num_ctx = num_ctx
+        # Oltre, il transcript riparte; il resto del contesto è per la risposta
+        self.max_chat_tokens = num_ctx - CHAT_ANSWER_TOKENS
         self.model_name = model_name
+        self.keep_alive = keep_alive
+        self.chunking = resolve_chunking(chunking)
+        self.chunk_stats = {}
+        self.embed_batch_size = 64
+        self.parse_workers = parse_workers or min(4, os.cpu_count() or 1)
+        self._search_cache = OrderedDict()  # (domanda, shard) -> hit, per la paginazione
+        
+        # Stato dell'inizializzazione (letto dalla UI mentre indicizza in background)
+        self.progress = {'stage': 'idle', 'done': 0, 'total': 0}
+        self.ready = False
+        self.error = None
+        self._init_thread = None
+        self._init_lock = threading.Lock()
+        # Motore condiviso fra le sessioni Streamlit: una (re)indicizzazione alla volta
+        self._index_lock = threading.RLock()
+        
+        # Tempi, conteggi e byte per fase (parse, split, embed, write, retrieval, LLM)
+        self.metrics = PipelineMetrics(metrics_log)
+        self._generation_handler = GenerationMetricsHandler(self.metrics)
+        
+        # Budget di memoria: picchi per fase e adattamento dell'indicizzazione
+        self.memory = MemoryGovernor(memory_budget, metrics=self.metrics)
+        self.spill_dir = str(Path(persist_directory) / "spill")
+        
+        # OCR per le pagine scansionate: pool di processi separato e cache per hash
+        self.ocr_pool = None
+        if ocr and ocr_available():
+            self.ocr_pool = OCRPool(
+                str(Path(persist_directory) / "ocr_cache"),
+                max_workers=ocr_workers
+            )
         
         print(f"🦙 Using Ollama model: {model_name}")
         
+        # Un solo client Chroma condiviso da tutte le shard
+        self.client = chromadb.PersistentClient(path=persist_directory)
+        
+        # Tutto il traffico verso Ollama passa da qui: le query prima dell'indicizzazione
+        self.scheduler = OllamaScheduler(workers=ollama_workers, metrics=self.metrics)
+        
         # GRATIS: Embeddings locali con Ollama
-        self.embeddings = OllamaEmbeddings(
-            model="nomic-embed-text"  # Modello embedding gratuito
+        self.embeddings = ScheduledEmbeddings(
+            TimedEmbeddings(
+                KeepAliveOllamaEmbeddings(
+                    model=EMBEDDING_MODEL,  # Modello embedding gratuito
+                    keep_alive=keep_alive
+                ),
+                self.metrics
+            ),
+            self.scheduler
         )
         
         # GRATIS: LLM locale con Ollama
-        self.llm = Ollama(
+        self.llm = self._make_llm(model_name)
+        
+        # Il caricamento dei modelli in Ollama parte subito, in background
+        if preload:
+            self.warmup()
+    
+    def _make_llm(self, model_name: str) -> Ollama:
+        return ScheduledOllama(
             model=model_name,
-            callback_manager=CallbackManager([StreamingStdOutCallbackHandler()]),
+            scheduler=self.scheduler,
+            keep_alive=self.keep_alive,
+            num_ctx=self.num_ctx,
+            callback_manager=CallbackManager([
+                StreamingStdOutCallbackHandler(),
+                self._generation_handler
+            ]),
             temperature=0
         )
     
-    def load_documents(self) -> List:
-        """Load all supported documents from the specified path"""
-        documents = []
+    def set_model(self, model_name: str):
+        """Swap the default LLM; the index and embeddings are untouched"""
+        self.model_name = model_name
+        self.llm = self._make_llm(model_name)
+        self.qa_chains.pop(model_name, None)
+        self.llms.pop(model_name, None)
+        self.setup_qa_chain()
+        self.warmup([model_name], embeddings=False)
+    
+    def warmup(
+        self,
+        models: Optional[List[str]] = None,
+        embeddings: bool = True,
+        background: bool = True
+    ):
+        """
+        Load models into Ollama memory ahead of the first request
         
-        loaders_map = {
-            '.pdf': PyPDFLoader,
-            '.txt': TextLoader,
-            '.docx': UnstructuredWordDocumentLoader,
-            '.doc': UnstructuredWordDocumentLoader
-        }
+        Models already loaded are skipped. Preloads go through the scheduler
+        at background priority, so they never delay a user query. Load times
+        are recorded as 'preload_llm' / 'preload_embeddings' metrics.
+        """
+        def _run():
+            try:
+                if embeddings and not is_loaded(EMBEDDING_MODEL):
+                    seconds = self.scheduler.submit(
+                        BACKGROUND, preload_embeddings, EMBEDDING_MODEL, self.keep_alive
+                    ).result()
+                    self.metrics.record('preload_embeddings', seconds, model=EMBEDDING_MODEL)
+                
+                for model in models or [self.model_name]:
+                    if is_loaded(model):
+                        continue
+                    seconds = self.scheduler.submit(
+                        BACKGROUND, preload_llm, model, self.keep_alive, num_ctx=self.num_ctx
+                    ).result()
+                    self.metrics.record('preload_llm', seconds, model=model)
+                    print(f"🔥 Modello {model} caricato in {seconds:.1f}s")
+            except Exception as e:
+                print(f"⚠️  Preload non riuscito: {str(e)}")
+        
+        if background:
+            threading.Thread(target=_run, daemon=True).start()
+        else:
+            _run()
+    
+    def _set_progress(self, stage: str, done: int, total: int):
+        self.progress = {'stage': stage, 'done': done, 'total': total}
+    
+    @property
+    def initializing(self) -> bool:
+        """True while initialize_in_background() is still running"""
+        return self._init_thread is not None and self._init_thread.is_alive()
+    
+    def load_documents(self, path: Optional[Path] = None, recursive: bool = True) -> List:
+        """Load all supported documents from path (default: documents_path)"""
+        documents, _ = self._load(Path(path) if path else self.documents_path, recursive)
+        try:
+            return list(documents)
+        finally:
+            documents.close()  # elimina l'eventuale file di spill
+    
+    def _iter_sources(self, files: List[Path]) -> Iterator[Dict]:
+        """Loose files and archive members to parse, each with its content hash"""
+        for i, file_path in enumerate(files, 1):
+            self._set_progress(f"📄 Lettura file ({file_path.parent.name})", i - 1, len(files))
+            
+            if archive_extension(file_path.name) is None:
+                # File illeggibile o sparito dopo la scansione: si salta e si continua
+                try:
+                    digest = hashlib.sha256()
+                    with open(file_path, 'rb') as f:
+                        for block in iter(lambda: f.read(1024 * 1024), b''):
+                            digest.update(block)
+                    size = file_path.stat().st_size
+                except OSError as e:
+                    print(f"❌ Error loading {file_path.name}: {str(e)}")
+                    continue
+                
+                yield {
+                    'source': str(file_path),
+                    'filename': file_path.name,
+                    'path': file_path,
+                    'hash': digest.hexdigest(),
+                    'size': size
+                }
+                continue
+            
+            # Archivi e mail: i membri restano in memoria, niente estrazione su disco
+            try:
+                with open(file_path, 'rb') as f:
+                    for source, data in iter_members(str(file_path), f, tuple(LOADERS)):
+                        yield {
+                            'source': source,
+                            'filename': member_filename(source),
+                            'archive': str(file_path),
+                            'data': data,
+                            'hash': content_hash(data),
+                            'size': len(data)
+                        }
+            except Exception as e:
+                print(f"❌ Error reading {file_path.name}: {str(e)}")
+    
+    def _parse(self, item: Dict) -> List:
+        """Parse one file or archive member into Documents (runs in a worker thread)"""
+        extension = Path(item['filename']).suffix.lower()
+        strategy = self.chunking.get(extension, self.chunking['default'])['strategy']
+        # Elementi separati per i Word: servono i titoli per lo split per sezioni
+        elements = strategy == 'heading' and extension in ('.docx', '.doc')
+        
+        with self.metrics.timer('parse', file=item['filename']) as info:
+            if 'path' in item:
+                loader_class = LOADERS[extension]
+                if elements:
+                    loader = loader_class(str(item['path']), mode="elements")
+                else:
+                    loader = loader_class(str(item['path']))
+                docs = loader.load()
+            else:
+                docs = load_bytes(item['source'], item['data'], elements=elements)
+            info['items'] = len(docs)
+            info['bytes'] = item['size']
+        
+        for doc in docs:
+            doc.metadata['source'] = item['source']
+            doc.metadata['filename'] = item['filename']
+            doc.metadata['content_hash'] = item['hash']
+            if 'archive' in item:
+                doc.metadata['archive'] = item['archive']
+        return docs
+    
+    def _load(
+        self,
+        path: Path,
+        recursive: bool = True,
+        known: Optional[Dict[str, str]] = None
+    ) -> Tuple[SpillBuffer, Dict[str, str]]:
+        """
+        Parse files and archive members under path in parallel
+        
+        Sources whose hash matches known (source -> hash) are not parsed.
+        Returns (documents, hash of every source found); documents is a
+        SpillBuffer that moves to disk when the memory budget is tight.
+        """
+        documents = SpillBuffer(self.memory, self.spill_dir)
+        waiting_ocr = []  # restano in memoria finché l'OCR non li completa
+        ocr_jobs = []
+        scanned = {}
+        known = known or {}
         
-        print(f"📁 Scanning directory: {self.documents_path}")
+        print(f"📁 Scanning directory: {path}")
         
-        for file_path in self.documents_path.rglob('*'):
-            if file_path.is_file():
-                extension = file_path.suffix.lower()
+        files = [
+            file_path for file_path in (path.rglob('*') if recursive else path.glob('*'))
+            if file_path.is_file() and (
+                file_path.suffix.lower() in LOADERS or archive_extension(file_path.name)
+            )
+        ]
+        
+        def _finish(item, future):
+            try:
+                docs = future.result()
+            except Exception as e:
+                print(f"❌ Error loading {item['filename']}: {str(e)}")
+                return
+            
+            # Le pagine scansionate vanno in OCR mentre continuiamo con gli altri file
+            jobs = []
+            if Path(item['filename']).suffix.lower() == '.pdf':
+                jobs = self._queue_ocr(item, docs)
+            
+            if jobs:
+                ocr_jobs.extend(jobs)
+                waiting_ocr.extend(docs)
+            else:
+                documents.extend(docs)
+            print(f"✅ Loaded: {item['source'] if 'archive' in item else item['filename']}")
+        
+        # Al massimo due file per worker in memoria (i membri degli archivi sono bytes);
+        # con poca memoria lavorano meno worker
+        pending = deque()
+        with self.memory.stage('parse'), ThreadPoolExecutor(max_workers=self.parse_workers) as executor:
+            for item in self._iter_sources(files):
+                scanned[item['source']] = item['hash']
+                if known.get(item['source']) == item['hash']:
+                    continue
                 
-                if extension in loaders_map:
-                    try:
-                        loader_class = loaders_map[extension]
-                        loader = loader_class(str(file_path))
-                        docs = loader.load()
-                        
-                        for doc in docs:
-                            doc.metadata['source'] = str(file_path)
-                            doc.metadata['filename'] = file_path.name
-                        
-                        documents.extend(docs)
-                        print(f"✅ Loaded: {file_path.name}")
-                    
-                    except Exception as e:
-                        print(f"❌ Error loading {file_path.name}: {str(e)}")
+                pending.append((item, executor.submit(self._parse, item)))
+                while len(pending) >= 2 * self.memory.scale(self.parse_workers):
+                    _finish(*pending.popleft())
+            
+            while pending:
+                _finish(*pending.popleft())
+        
+        if ocr_jobs:
+            self._collect_ocr(ocr_jobs)
+            documents.extend(waiting_ocr)
+            # Processi OCR chiusi fino alla prossima indicizzazione (il pool si ricrea)
+            self.ocr_pool.shutdown()
         
         print(f"\n📊 Total documents loaded: {len(documents)}")
-        return documents
+        return documents, scanned
     
-    def create_vector_store(self, documents: List):
-        """Create vector store from documents"""
-        print("\n🔄 Splitting documents into chunks...")
+    def _queue_ocr(self, item: Dict, pages: List) -> List[Tuple]:
+        """Submit the image-only pages of a PDF (file or archive member) to the OCR pool"""
+        scanned = [doc for doc in pages if is_image_only(doc.page_content)]
+        if not scanned:
+            return []
+        
+        if self.ocr_pool is None:
+            print(f"⚠️  {item['filename']}: {len(scanned)} pagine senza testo "
+                  f"(installa tesseract + pytesseract per l'OCR)")
+            return []
+        
+        pdf = str(item['path']) if 'path' in item else io.BytesIO(item['data'])
+        page_pdfs = extract_pages(pdf, [doc.metadata['page'] for doc in scanned])
+        print(f"🔍 {item['filename']}: {len(scanned)} pagine scansionate in coda per OCR")
+        return [(doc, self.ocr_pool.submit(page_pdf)) for doc, page_pdf in zip(scanned, page_pdfs)]
+    
+    def _collect_ocr(self, ocr_jobs: List[Tuple]):
+        """Wait for queued OCR pages and fill in their text"""
+        with self.metrics.timer('ocr_wait') as info:
+            for i, (doc, future) in enumerate(ocr_jobs):
+                self._set_progress("🔍 OCR pagine scansionate", i, len(ocr_jobs))
+                try:
+                    doc.page_content = future.result()
+                    doc.metadata['ocr'] = True
+                except Exception as e:
+                    print(f"❌ OCR fallito per {doc.metadata.get('filename')} "
+                          f"p.{doc.metadata.get('page')}: {str(e)}")
+            info['items'] = len(ocr_jobs)
         
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
+        stats = self.ocr_pool.stats
+        self.metrics.set_gauge('ocr_pages_total', stats['pages'])
+        self.metrics.set_gauge('ocr_cache_hits_total', stats['cache_hits'])
+        self.metrics.set_gauge('ocr_seconds_total', round(stats['ocr_seconds'], 3))
+    
+    def shard_layout(self) -> Dict[str, Dict]:
+        """Map each shard (Chroma collection) name to the folder it indexes"""
+        return shard_layout(self.documents_path, self.shard_by, self.collection_name)
+    
+    def _open_shard(self, name: str) -> Chroma:
+        """Open (or create) the Chroma collection of a shard"""
+        return Chroma(
+            client=self.client,
+            collection_name=name,
+            embedding_function=self.embeddings
         )
+    
+    def load_manifest(self) -> Dict:
+        """Read collections.json (shard -> folder, chunks, chunking config)"""
+        if self.manifest_path.exists():
+            return json.loads(self.manifest_path.read_text(encoding='utf-8'))
+        return {}
+    
+    def _outdated_reason(self, entry: Dict) -> Optional[str]:
+        """Why an indexed shard can't be reused as is (None if it can)"""
+        # Manifest senza questi campi (versioni precedenti): si riusa
+        if entry.get('chunking', self.chunking) != self.chunking:
+            return "configurazione di chunking cambiata"
+        if entry.get('embedding_model', EMBEDDING_MODEL) != EMBEDDING_MODEL:
+            return f"modello di embedding cambiato ({entry['embedding_model']} → {EMBEDDING_MODEL})"
+        return None
+    
+    def _update_manifest(self, name: str, shard_path: Path, chunks: int):
+        # collections.json è condiviso da tutti i motori sullo stesso persist_directory
+        with _MANIFEST_LOCK:
+            self._write_manifest_entry(name, shard_path, chunks)
+    
+    def _write_manifest_entry(self, name: str, shard_path: Path, chunks: int):
+        manifest = self.load_manifest()
+        manifest[name] = {
+            'documents_path': str(self.documents_path.resolve()),
+            'source_root': str(self.documents_path),  # prefisso dei 'source' dei chunk
+            'shard_path': str(Path(shard_path).resolve()),
+            'shard_by': self.shard_by,
+            'collection_name': self.collection_name,
+            'chunks': chunks,
+            'chunking': self.chunking,
+            'embedding_model': EMBEDDING_MODEL,
+            'updated': datetime.now().isoformat(timespec='seconds')
+        }
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        # Scrittura atomica: chi legge non vede mai un file a metà
+        partial = self.manifest_path.with_suffix('.tmp')
+        partial.write_text(json.dumps(manifest, indent=2), encoding='utf-8')
+        os.replace(partial, self.manifest_path)
+    
+    def create_vector_store(
+        self,
+        documents: List,
+        shard: Optional[str] = None,
+        stale: Optional[List[str]] = None
+    ):
+        """
+        Create (or replace) the vector store of one shard from documents
+        
+        With stale (list of sources) the collection is updated in place:
+        chunks of those sources are deleted and documents are added.
+        """
+        with self._index_lock:
+            return self._create_vector_store(documents, shard, stale)
+    
+    def _create_vector_store(self, documents: List, shard: Optional[str], stale: Optional[List[str]]):
+        layout = self.shard_layout()
+        name = shard or next(iter(layout))
         
-        texts = text_splitter.split_documents(documents)
-        print(f"📝 Created {len(texts)} text chunks")
+        print("\n🔄 Splitting documents into chunks...")
+        
+        with self.metrics.timer('split', shard=name) as info, self.memory.stage('split'):
+            texts = self._split(documents)
+            info['items'] = len(texts)
+            info['bytes'] = self.chunk_stats['total']['bytes']
+        self.print_chunk_stats()
         
         print("\n🧠 Creating vector embeddings with Ollama (FREE)...")
         print("   ⏳ This may take a few minutes on first run...")
         
-        self.vectorstore = Chroma.from_documents(
-            documents=texts,
-            embedding=self.embeddings,
-            persist_directory=self.persist_directory
-        )
+        self._search_cache.clear()
+        if stale is None:
+            # Ricostruzione della sola shard: le altre collection restano intatte
+            try:
+                self.client.delete_collection(name)
+            except ValueError:
+                pass
+            # Sostituita subito: l'indice parziale è interrogabile durante l'embedding
+            self.shards[name] = self._open_shard(name)
+        elif name not in self.shards:
+            self.shards[name] = self._open_shard(name)
+        collection = self.client.get_collection(name)
+        
+        # Aggiornamento incrementale: via i chunk dei file modificati o rimossi
+        for start in range(0, len(stale or []), 500):
+            collection.delete(where={'source': {'$in': stale[start:start + 500]}})
+        
+        # Embedding e scrittura separati, così i tempi di Ollama e Chroma restano distinti;
+        # i batch si accorciano se la memoria scarseggia
+        done = 0
+        total = len(texts)  # close() svuota il buffer: il totale va letto prima
+        batch = []
+        try:
+            with self.memory.stage('embed'):
+                for doc in texts:
+                    batch.append(doc)
+                    if len(batch) < self.memory.scale(self.embed_batch_size, minimum=8):
+                        continue
+                    self._embed_batch(collection, batch, name)
+                    done += len(batch)
+                    self._set_progress(f"🧠 Embedding ({name})", done, total)
+                    batch = []
+                if batch:
+                    self._embed_batch(collection, batch, name)
+        finally:
+            texts.close()
+        self._set_progress(f"🧠 Embedding ({name})", total, total)
+        
+        shard_path = layout[name]['path'] if name in layout else self.documents_path
+        self._update_manifest(name, shard_path, collection.count())
+        
+        print(f"✅ Vector store created successfully! (collection: {name})")
+    
+    def _split(self, documents, slice_size: int = 500) -> SpillBuffer:
+        """
+        Split documents in slices (whole sources only) into a SpillBuffer
+        
+        Only one slice of documents and its chunks are in memory at a time
+        when the buffers spill; stats are merged into self.chunk_stats.
+        """
+        chunks = SpillBuffer(self.memory, self.spill_dir)
+        self.chunk_stats = {}
         
-        print("✅ Vector store created successfully!")
+        def _flush(group):
+            if group:
+                group_chunks, stats = split_documents(group, self.chunking)
+                chunks.extend(group_chunks)
+                self.chunk_stats = merge_stats(self.chunk_stats, stats)
+        
+        group = []
+        for doc in documents:
+            # Un sorgente non va diviso tra due slice (titoli dei Word, pagine dei PDF)
+            if len(group) >= slice_size and doc.metadata.get('source') != group[-1].metadata.get('source'):
+                _flush(group)
+                group = []
+            group.append(doc)
+        _flush(group)
+        
+        if not self.chunk_stats:
+            _, self.chunk_stats = split_documents([], self.chunking)
+        return chunks
+    
+    def _embed_batch(self, collection, batch: List, name: str):
+        """Embed one batch of chunks and write it to the collection"""
+        contents = [doc.page_content for doc in batch]
+        vectors = self.embeddings.embed_documents(contents)
+        
+        with self.metrics.timer('chroma_write', shard=name) as info:
+            collection.add(
+                ids=[str(uuid.uuid4()) for _ in batch],
+                embeddings=vectors,
+                metadatas=[doc.metadata for doc in batch],
+                documents=contents
+            )
+            info['items'] = len(batch)
+        self._search_cache.clear()
+    
+    def _indexed_hashes(self, name: str) -> Optional[Dict[str, str]]:
+        """source -> content_hash already in a collection (None if not comparable)"""
+        try:
+            collection = self.client.get_collection(name)
+        except ValueError:
+            return None
+        
+        hashes = {}
+        for offset in range(0, collection.count(), 5000):
+            batch = collection.get(include=['metadatas'], limit=5000, offset=offset)
+            for metadata in batch['metadatas']:
+                # Indice creato prima degli hash: va ricostruito da zero
+                if 'content_hash' not in metadata:
+                    return None
+                hashes[metadata['source']] = metadata['content_hash']
+        return hashes
+    
+    def index_shard(self, name: str, incremental: bool = False) -> bool:
+        """
+        Load, split and embed a single shard from scratch
+        
+        With incremental=True (see update_shard) only files and archive
+        members whose content hash changed are parsed and re-embedded and
+        removed ones are deleted. Concurrent calls (other sessions) wait.
+        """
+        with self._index_lock:
+            return self._index_shard(name, incremental)
+    
+    def _index_shard(self, name: str, incremental: bool) -> bool:
+        layout = self.shard_layout()
+        
+        if name not in layout:
+            raise ValueError(f"Shard sconosciuta: {name}")
+        
+        spec = layout[name]
+        print(f"\n📦 Shard {name} ← {spec['path']}")
+        
+        if incremental:
+            reason = self._outdated_reason(self.load_manifest().get(name, {}))
+            if reason:
+                print(f"⚠️  Shard {name}: {reason}, ricostruzione completa")
+                incremental = False
+        
+        indexed = self._indexed_hashes(name) if incremental else None
+        documents, scanned = self._load(spec['path'], spec['recursive'], known=indexed)
+        
+        try:
+            if indexed is None:
+                if not documents:
+                    print(f"⚠️  No documents found in {spec['path']}")
+                    return False
+                self.create_vector_store(documents, shard=name)
+                return True
+            
+            changed = {source for source, digest in scanned.items() if indexed.get(source) != digest}
+            removed = set(indexed) - set(scanned)
+            if not changed and not removed:
+                self.shards.setdefault(name, self._open_shard(name))
+                print(f"✅ Shard {name} già aggiornata")
+                return True
+            
+            print(f"🔄 {len(changed)} file nuovi o modificati, {len(removed)} rimossi")
+            self.create_vector_store(
+                documents, shard=name,
+                stale=sorted((changed & set(indexed)) | removed)
+            )
+            return True
+        finally:
+            documents.close()  # elimina l'eventuale file di spill
+    
+    def update_shard(self, name: str) -> bool:
+        """Re-index only new, changed or removed files of a shard"""
+        return self.index_shard(name, incremental=True)
+    
+    def search_shards(
+        self,
+        question: str,
+        k: int = 3,
+        shards: Optional[List[str]] = None,
+        embedding: Optional[List[float]] = None
+    ) -> List[Tuple]:
+        """
+        Fan out a similarity search over the selected shards in parallel
+        
+        Returns the merged top-k as (document, distance) pairs, lowest
+        distance first. The query is embedded once (unless embedding is
+        given) and reused for every shard.
+        """
+        # Copia: una ricostruzione in corso può sostituire le shard nel frattempo
+        available = dict(self.shards)
+        names = [name for name in (shards or list(available)) if name in available]
+        if not names:
+            return []
+        
+        def _search(name):
+            try:
+                hits = available[name].similarity_search_by_vector_with_relevance_scores(
+                    embedding, k=k
+                )
+            except Exception as e:
+                # Collection eliminata da una ricostruzione: si riprova su quella nuova
+                current = self.shards.get(name)
+                if current is None or current is available[name]:
+                    print(f"⚠️  Shard {name} non interrogabile: {str(e)}")
+                    return []
+                hits = current.similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+            for doc, _ in hits:
+                doc.metadata['shard'] = name
+            return hits
+        
+        with self.metrics.timer('retrieval', shards=len(names)) as info, self.memory.stage('retrieval'):
+            if embedding is None:
+                embedding = self.embeddings.embed_query(question)
+            
+            with ThreadPoolExecutor(max_workers=min(8, len(names))) as pool:
+                results = list(pool.map(_search, names))
+            
+            merged = sorted((hit for hits in results for hit in hits), key=lambda hit: hit[1])
+            info['items'] = len(merged[:k])
+        
+        return merged[:k]
+    
+    def print_chunk_stats(self):
+        """Print chunk count, average length and overlap per extension"""
+        total = self.chunk_stats.get('total', {})
+        print(f"📝 Created {total.get('chunks', 0)} text chunks "
+              f"(~{total.get('avg_tokens', 0):.0f} token/chunk, "
+              f"overlap {total.get('overlap_bytes', 0):,} bytes)")
+        
+        for ext, data in self.chunk_stats.get('by_extension', {}).items():
+            print(f"   {ext:8} [{data['strategy']:9}] {data['chunks']:6,} chunks  "
+                  f"avg {data['avg_tokens']:.0f} tok  overlap {data['overlap_bytes']:,} B")
     
     def setup_qa_chain(self):
         """Setup the QA chain for querying"""
+        self.qa_chain = self._build_qa_chain(self.llm)
+        print("🔗 QA Chain configured!")
+    
+    def _build_qa_chain(self, llm):
         
         template = """Usa i seguenti pezzi di contesto per rispondere alla domanda.
 Se non conosci la risposta, di' semplicemente che non lo sai.
@@ -151,52 +793,331 @@ Risposta:"""
             template=template
         )
         
-        self.qa_chain = RetrievalQA.from_chain_type(
-            llm=self.llm,
+        # Il retrieval lo facciamo noi (fan-out sulle shard), qui solo la generazione
+        return load_qa_chain(
+            llm=llm,
             chain_type="stuff",
-            retriever=self.vectorstore.as_retriever(
-                search_kwargs={"k": 3}
-            ),
-            chain_type_kwargs={"prompt": QA_CHAIN_PROMPT},
-            return_source_documents=True
+            prompt=QA_CHAIN_PROMPT
         )
+    
+    def _llm_for(self, model_name: Optional[str] = None) -> Ollama:
+        if model_name is None or model_name == self.model_name:
+            return self.llm
         
-        print("🔗 QA Chain configured!")
+        if model_name not in self.llms:
+            self.llms[model_name] = self._make_llm(model_name)
+        return self.llms[model_name]
+    
+    def _qa_chain_for(self, model_name: Optional[str] = None):
+        """QA chain for a model; other models share the same index"""
+        if model_name is None or model_name == self.model_name:
+            return self.qa_chain
+        
+        if model_name not in self.qa_chains:
+            self.qa_chains[model_name] = self._build_qa_chain(self._llm_for(model_name))
+        return self.qa_chains[model_name]
     
-    def query(self, question: str) -> dict:
-        """Query the RAG system"""
+    @staticmethod
+    def _sources(docs: List) -> List[Dict]:
+        return [
+            {
+                "filename": doc.metadata.get("filename", "Unknown"),
+                "page": doc.metadata.get("page"),
+                "shard": doc.metadata.get("shard"),
+                "content": doc.page_content[:200] + "..."
+            }
+            for doc in docs
+        ]
+    
+    def _answer(self, question: str, docs: List, model_name: Optional[str] = None) -> dict:
+        """Generate an answer from already retrieved documents"""
         if self.qa_chain is None:
             raise ValueError("QA chain not initialized.")
         
         print(f"\n💭 Thinking...")
-        result = self.qa_chain({"query": question})
+        with self.memory.stage('generation'):
+            result = self._qa_chain_for(model_name)({"input_documents": docs, "question": question})
+        
+        return {
+            "answer": result["output_text"],
+            "sources": self._sources(docs)
+        }
+    
+    def query(
+        self,
+        question: str,
+        shards: Optional[List[str]] = None,
+        model_name: Optional[str] = None,
+        k: int = 3
+    ) -> dict:
+        """
+        Query the RAG system
+        
+        Args:
+            question: User question
+            shards: Only search these collections (default: all)
+            model_name: Answer with this LLM instead of the default one
+            k: Chunks passed to the LLM as context
+        """
+        with self.metrics.timer('query', model=model_name or self.model_name):
+            docs = [doc for doc, _ in self.search_shards(question, k=k, shards=shards)]
+            return self._answer(question, docs, model_name)
+    
+    def search(
+        self,
+        question: str,
+        page: int = 1,
+        page_size: int = 10,
+        shards: Optional[List[str]] = None,
+        max_results: int = 50
+    ) -> dict:
+        """
+        Retrieval only: ranked passages without any LLM generation
+        
+        The top max_results hits are fetched once and cached, so moving
+        between pages does not embed the question again.
+        
+        Returns:
+            {'results': [...], 'total', 'page', 'pages', 'seconds'}; each
+            result has rank, filename, source, page, shard, distance,
+            content, highlights (char spans) and a **highlighted** snippet.
+        """
+        start_time = time.perf_counter()
+        key = (question.strip(), tuple(sorted(shards)) if shards else None)
+        
+        with self.metrics.timer('search') as info:
+            if key in self._search_cache:
+                self._search_cache.move_to_end(key)
+                hits = self._search_cache[key]
+            else:
+                hits = self.search_shards(question, k=max_results, shards=shards)
+                self._search_cache[key] = hits
+                if len(self._search_cache) > 32:
+                    self._search_cache.popitem(last=False)
+            
+            terms = query_terms(question)
+            first = (page - 1) * page_size
+            results = []
+            
+            for rank, (doc, distance) in enumerate(hits[first:first + page_size], first + 1):
+                spans = highlight_spans(doc.page_content, terms)
+                page_number = doc.metadata.get('page')
+                results.append({
+                    'rank': rank,
+                    'filename': doc.metadata.get('filename', 'Unknown'),
+                    'source': doc.metadata.get('source'),
+                    'page': page_number + 1 if isinstance(page_number, int) else None,
+                    'shard': doc.metadata.get('shard'),
+                    'distance': distance,
+                    'content': doc.page_content,
+                    'highlights': spans,
+                    'snippet': make_snippet(doc.page_content, spans)
+                })
+            info['items'] = len(results)
         
         return {
-            "answer": result["result"],
-            "sources": [
-                {
-                    "filename": doc.metadata.get("filename", "Unknown"),
-                    "content": doc.page_content[:200] + "..."
+            'query': question,
+            'results': results,
+            'total': len(hits),
+            'page': page,
+            'pages': max(1, -(-len(hits) // page_size)),
+            'seconds': time.perf_counter() - start_time
+        }
+    
+    def answer_from_results(
+        self,
+        question: str,
+        results: List[Dict],
+        model_name: Optional[str] = None
+    ) -> dict:
+        """Generate an answer on demand from passages returned by search()"""
+        docs = [
+            Document(
+                page_content=r['content'],
+                metadata={
+                    'filename': r['filename'],
+                    'source': r['source'],
+                    'page': r['page'] - 1 if r['page'] else None,
+                    'shard': r['shard']
                 }
-                for doc in result["source_documents"]
-            ]
+            )
+            for r in results
+        ]
+        with self.metrics.timer('query', model=model_name or self.model_name):
+            return self._answer(question, docs, model_name)
+    
+    def start_conversation(self) -> str:
+        """Open a conversation for chat(); returns its id"""
+        conversation_id = uuid.uuid4().hex
+        self.conversations[conversation_id] = {
+            'turns': [],          # (domanda, risposta)
+            'transcript': '',     # prompt accumulato, solo in append
+            'seen': set(),        # chunk già nel transcript
+            'docs': [],           # ultimi chunk recuperati (fonti)
+            'embedding': None,    # embedding dell'ultima domanda usata per il retrieval
+            'shards': None        # shard interrogate per quei chunk
         }
+        
+        while len(self.conversations) > 100:
+            self.conversations.popitem(last=False)
+        return conversation_id
     
-    def initialize(self):
-        """Complete initialization process"""
+    def _condense(self, conversation: Dict, question: str, model_name: Optional[str]) -> str:
+        """Rewrite a follow-up as a standalone question, appended to the chat transcript"""
+        prompt = CHAT_PREFIX + conversation['transcript'] + CONDENSE_TEMPLATE.format(question=question)
+        
+        with self.metrics.timer('chat_condense'):
+            standalone = self._llm_for(model_name).invoke(prompt, stop=["\n"]).strip()
+        return standalone or question
+    
+    def chat(
+        self,
+        question: str,
+        conversation_id: str,
+        shards: Optional[List[str]] = None,
+        model_name: Optional[str] = None,
+        k: int = 3
+    ) -> dict:
+        """
+        Answer a follow-up within a conversation
+        
+        The follow-up is condensed against the history into a standalone
+        question. If that question is close to the one used for the last
+        retrieval (cosine >= reuse_threshold) and the shards are the same,
+        the chunks already in the conversation are reused and retrieval is
+        skipped. The prompt is an append-only transcript after a fixed
+        prefix, so each turn shares its whole prefix with the previous one
+        (and with the condense prompt) and Ollama can reuse the cache.
+        """
+        conversation = self.conversations.get(conversation_id)
+        if conversation is None:
+            raise ValueError(f"Conversazione sconosciuta: {conversation_id}")
+        
+        llm = self._llm_for(model_name)
+        count_tokens = token_length_function()
+        
+        with self.metrics.timer('chat', model=model_name or self.model_name) as info:
+            standalone = question
+            if conversation['turns']:
+                standalone = self._condense(conversation, question, model_name)
+            
+            embedding = self.embeddings.embed_query(standalone)
+            shard_key = sorted(shards) if shards else None
+            reused = (
+                conversation['embedding'] is not None
+                and conversation['shards'] == shard_key
+                and _cosine(embedding, conversation['embedding']) >= self.reuse_threshold
+            )
+            
+            new_docs = []
+            if not reused:
+                docs = [doc for doc, _ in self.search_shards(
+                    standalone, k=k, shards=shards, embedding=embedding
+                )]
+                conversation['docs'] = docs
+                conversation['embedding'] = embedding
+                conversation['shards'] = shard_key
+                new_docs = [doc for doc in docs if doc.page_content not in conversation['seen']]
+            info['reused'] = reused
+            
+            def _block(docs, first, text):
+                block = ""
+                if docs:
+                    block += "Contesto:\n" if first else "Contesto aggiuntivo:\n"
+                    block += "\n\n".join(doc.page_content for doc in docs) + "\n\n"
+                return block + f"Domanda: {text}\nRisposta:"
+            
+            block = _block(new_docs, not conversation['transcript'], question)
+            
+            # Transcript troppo lungo per il contesto del modello: si riparte
+            # senza storia, quindi con la domanda autonoma e non il follow-up
+            info['reset'] = False
+            if count_tokens(CHAT_PREFIX + conversation['transcript'] + block) > self.max_chat_tokens:
+                conversation['transcript'] = ''
+                conversation['seen'] = set()
+                new_docs = conversation['docs']
+                block = _block(new_docs, True, standalone)
+                info['reset'] = True
+            
+            with self.memory.stage('generation'):
+                answer = llm.invoke(CHAT_PREFIX + conversation['transcript'] + block).strip()
+            
+            conversation['transcript'] += f"{block} {answer}\n\n"
+            conversation['seen'].update(doc.page_content for doc in new_docs)
+            conversation['turns'].append((question, answer))
+        
+        return {
+            "answer": answer,
+            "standalone_question": standalone,
+            "reused_context": reused,
+            "sources": self._sources(conversation['docs'])
+        }
+    
+    def initialize(self, rebuild: bool = False):
+        """
+        Complete initialization process
+        
+        Shards already present in collections.json are reopened without
+        re-embedding, unless they were built with a different chunking
+        config or embedding model; pass rebuild=True to re-index all of them.
+        """
         print("🚀 Initializing FREE RAG System with Ollama...\n")
         
-        documents = self.load_documents()
+        self.ready = False
+        self.error = None
+        
+        # La chain serve subito: le shard già pronte sono interrogabili da ora
+        self.setup_qa_chain()
+        
+        with self._index_lock:
+            manifest = self.load_manifest()
+            
+            for name in self.shard_layout():
+                entry = manifest.get(name, {})
+                reason = self._outdated_reason(entry) if entry.get('chunks') else None
+                if reason:
+                    print(f"⚠️  Shard {name}: {reason}, ricostruzione completa")
+                    self.index_shard(name, incremental=False)
+                elif not rebuild and entry.get('chunks'):
+                    self.shards[name] = self._open_shard(name)
+                    print(f"♻️  Shard {name}: riuso indice esistente "
+                          f"({entry['chunks']} chunks)")
+                else:
+                    self.index_shard(name, incremental=not rebuild)
+        
+        self._set_progress('done', 1, 1)
+        self.metrics.set_gauge('shards', len(self.shards))
         
-        if not documents:
+        if not self.shards:
             print("⚠️  No documents found!")
             return False
         
-        self.create_vector_store(documents)
-        self.setup_qa_chain()
-        
+        self.ready = True
         print("\n✅ FREE RAG System ready!")
         return True
+    
+    def initialize_in_background(self, rebuild: bool = False) -> threading.Thread:
+        """
+        Run initialize() in a daemon thread
+        
+        Poll self.progress / self.ready / self.error meanwhile; query() works
+        on the shards indexed so far. While a run is in progress its thread
+        is returned instead of starting another one.
+        """
+        def _run():
+            try:
+                if not self.initialize(rebuild=rebuild):
+                    self.error = "Nessun documento trovato"
+            except Exception as e:
+                self.error = str(e)
+                print(f"❌ Errore inizializzazione: {str(e)}")
+        
+        with self._init_lock:
+            if self.initializing:
+                return self._init_thread
+            self._init_thread = threading.Thread(target=_run, daemon=True)
+            self._init_thread.start()
+            return self._init_thread
 
 
 def check_ollama_installed():
@@ -297,9 +1218,16 @@ def main():
     # Initialize RAG
     rag = FreeLocalRAG(
         documents_path=DOCUMENTS_PATH,
-        model_name=MODEL_NAME
+        model_name=MODEL_NAME,
+        memory_budget=os.environ.get('RAG_MEMORY_BUDGET')  # es. "3GB"
     )
     
+    # Endpoint Prometheus opzionale: RAG_METRICS_PORT=9108
+    metrics_port = os.environ.get('RAG_METRICS_PORT')
+    if metrics_port:
+        rag.metrics.serve(int(metrics_port))
+        print(f"📈 Metriche su http://127.0.0.1:{metrics_port}/metrics\n")
+    
     if not rag.initialize():
         return
     
@@ -308,8 +1236,16 @@ def main():
     print("💬 Sistema Pronto! Fai domande sui tuoi documenti")
     print("   Scrivi 'exit' per uscire")
     print("   Scrivi 'model' per cambiare modello")
+    print("   Scrivi 'shards' per elencare le collection")
+    print("   Scrivi 'rebuild <shard>' per reindicizzare una collection")
+    print("   Scrivi 'update <shard>' per indicizzare solo i file nuovi o modificati")
+    print("   Scrivi 'metrics' per i tempi di ogni fase")
+    print("   Scrivi 'cerca <testo>' per trovare i passaggi senza generare risposta")
+    print("   Scrivi 'chat' per attivare/disattivare le domande di follow-up")
     print("="*60 + "\n")
     
+    conversation_id = None  # attivo in modalità chat
+    
     while True:
         question = input("🤔 Domanda: ").strip()
         
@@ -324,15 +1260,67 @@ def main():
             print("   - llama3.1 (potente)")
             print("   - phi3 (efficiente)")
             new_model = input("Scegli modello: ").strip()
-            rag.llm.model = new_model
+            rag.set_model(new_model)
             print(f"✅ Cambiato a: {new_model}\n")
             continue
         
+        if question.lower() == 'shards':
+            manifest = rag.load_manifest()
+            print("\n📦 Collections:")
+            for name in rag.shards:
+                info = manifest.get(name, {})
+                print(f"   - {name}  ({info.get('chunks', '?')} chunks, {info.get('shard_path', '')})")
+            print()
+            continue
+        
+        if question.lower() == 'chat':
+            conversation_id = None if conversation_id else rag.start_conversation()
+            print(f"🧵 Modalità chat {'attiva' if conversation_id else 'disattivata'}\n")
+            continue
+        
+        if question.lower().startswith('cerca '):
+            found = rag.search(question.split(maxsplit=1)[1])
+            print(f"\n🔎 {found['total']} passaggi ({found['seconds']:.2f}s)")
+            for r in found['results']:
+                where = f" p.{r['page']}" if r['page'] else ""
+                print(f"   {r['rank']:2}. {r['filename']}{where}  (distanza {r['distance']:.3f})")
+                print(f"       {r['snippet']}")
+            print()
+            continue
+        
+        if question.lower() == 'metrics':
+            print()
+            print(rag.metrics.to_prometheus())
+            
+            memory = rag.memory.report()
+            mb = lambda n: f"{(n or 0) / 1024 / 1024:.0f} MB"
+            print(f"🧠 Memoria: {mb(memory['rss'])} (picco {mb(memory['peak'])}, "
+                  f"budget {mb(memory['budget']) if memory['budget'] else 'nessuno'})")
+            for stage, peak in sorted(memory['stages'].items()):
+                print(f"   {stage:12} picco {mb(peak)}")
+            print()
+            continue
+        
+        if question.lower().startswith(('rebuild ', 'update ')):
+            command, name = question.split(maxsplit=1)
+            try:
+                if command.lower() == 'update':
+                    rag.update_shard(name)
+                else:
+                    rag.index_shard(name, incremental=False)
+            except ValueError as e:
+                print(f"❌ Errore: {str(e)}")
+            print()
+            continue
+        
         if not question:
             continue
         
         try:
-            result = rag.query(question)
+            if conversation_id:
+                result = rag.chat(question, conversation_id)
+            else:
+                result = rag.query(question)
             
             print(f"\n💡 Risposta: {result['answer']}\n")
             print("📚 Fonti:")
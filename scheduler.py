@@ -0,0 +1,232 @@
+"""
+Scheduler delle richieste a Ollama
+Code con priorità: le domande dell'utente passano davanti all'indicizzazione
+"""
+
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+
+from langchain.schema.embeddings import Embeddings
+from langchain_community.llms import Ollama
+
+
+INTERACTIVE = 0   # query utente: embedding della domanda e generazione
+BACKGROUND = 10   # indicizzazione
+
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+
+class OllamaScheduler:
+    """
+    Priority queue in front of the local Ollama server
+
+    Interactive jobs always run before queued background jobs. Background
+    jobs are also held back while an interactive job is running and are
+    delayed further when interactive queue wait rises above latency_target.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        latency_target: float = 0.5,
+        max_backoff: float = 2.0,
+        cooldown: float = 30.0,
+        metrics: Optional[Any] = None
+    ):
+        """
+        Args:
+            workers: Concurrent requests sent to Ollama
+            latency_target: Interactive queue wait (s) above which indexing slows down
+            max_backoff: Longest pause (s) imposed on a background job
+            cooldown: Seconds after the last query before indexing runs at full speed
+            metrics: Optional PipelineMetrics for wait times and queue depth
+        """
+        self.latency_target = latency_target
+        self.max_backoff = max_backoff
+        self.cooldown = cooldown
+        self.metrics = metrics
+
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._interactive_arrived = threading.Event()
+        self._interactive_running = 0
+        self._last_interactive = 0.0
+        self._wait_ewma = 0.0
+
+        self.stats = {
+            name: {'submitted': 0, 'completed': 0, 'queued': 0,
+                   'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+            for name in PRIORITY_NAMES.values()
+        }
+        self.stats['background']['throttled'] = 0
+
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, priority: int, fn, *args, **kwargs) -> Future:
+        """Queue fn(*args, **kwargs); lower priority value runs first"""
+        future = Future()
+        name = PRIORITY_NAMES.get(priority, 'background')
+
+        with self._lock:
+            self.stats[name]['submitted'] += 1
+            self.stats[name]['queued'] += 1
+            if priority == INTERACTIVE:
+                self._last_interactive = time.monotonic()
+
+        self._queue.put((priority, next(self._sequence), time.monotonic(), fn, args, kwargs, future))
+
+        if priority == INTERACTIVE:
+            self._interactive_arrived.set()
+        self._report_depth()
+        return future
+
+    def run(self, priority: int, fn, *args, **kwargs):
+        """Submit and wait for the result"""
+        return self.submit(priority, fn, *args, **kwargs).result()
+
+    def _backoff(self) -> float:
+        """Pause before the next background job (0 = run now)"""
+        with self._lock:
+            if self._interactive_running:
+                return self.max_backoff
+
+            recent = time.monotonic() - self._last_interactive < self.cooldown
+            if not recent or self._wait_ewma <= self.latency_target:
+                return 0.0
+
+            return min(self.max_backoff, self._wait_ewma / self.latency_target * 0.25)
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            priority, sequence, enqueued, fn, args, kwargs, future = item
+
+            if priority != INTERACTIVE:
+                delay = self._backoff()
+                if delay > 0:
+                    with self._lock:
+                        self.stats['background']['throttled'] += 1
+                    # Pausa; se nel frattempo arriva una query il job torna in coda dietro di lei
+                    self._interactive_arrived.clear()
+                    if self._interactive_arrived.wait(timeout=delay):
+                        self._queue.put(item)
+                        continue
+
+            self._run(priority, enqueued, fn, args, kwargs, future)
+
+    def _run(self, priority, enqueued, fn, args, kwargs, future):
+        name = PRIORITY_NAMES.get(priority, 'background')
+        wait = time.monotonic() - enqueued
+
+        with self._lock:
+            data = self.stats[name]
+            data['queued'] -= 1
+            data['wait_seconds'] += wait
+            data['max_wait_seconds'] = max(data['max_wait_seconds'], wait)
+            if priority == INTERACTIVE:
+                self._interactive_running += 1
+                self._wait_ewma = 0.7 * self._wait_ewma + 0.3 * wait
+
+        if self.metrics is not None:
+            self.metrics.record(f'queue_wait_{name}', wait)
+        self._report_depth()
+
+        try:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+        finally:
+            with self._lock:
+                self.stats[name]['completed'] += 1
+                if priority == INTERACTIVE:
+                    self._interactive_running -= 1
+
+    def _report_depth(self):
+        if self.metrics is None:
+            return
+        with self._lock:
+            for name in PRIORITY_NAMES.values():
+                self.metrics.set_gauge(f'queue_depth_{name}', self.stats[name]['queued'])
+
+    def report(self) -> Dict:
+        """Queue depth, completed jobs and wait times per priority class"""
+        with self._lock:
+            report = {}
+            for name, data in self.stats.items():
+                done = data['completed']
+                report[name] = {
+                    **data,
+                    'avg_wait_seconds': data['wait_seconds'] / done if done else 0.0
+                }
+            report['interactive_wait_ewma'] = self._wait_ewma
+            return report
+
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    Embeddings routed through the scheduler
+
+    Documents go in small background sub-batches, so a query waits for at
+    most one sub-batch; queries are embedded at interactive priority.
+    """
+
+    def __init__(self, embeddings: Embeddings, scheduler: OllamaScheduler, sub_batch: int = 8):
+        self.embeddings = embeddings
+        self.scheduler = scheduler
+        self.sub_batch = sub_batch
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        futures = [
+            self.scheduler.submit(
+                BACKGROUND, self.embeddings.embed_documents, texts[i:i + self.sub_batch]
+            )
+            for i in range(0, len(texts), self.sub_batch)
+        ]
+        vectors = []
+        for future in futures:
+            vectors.extend(future.result())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.scheduler.run(INTERACTIVE, self.embeddings.embed_query, text)
+
+
+class ScheduledOllama(Ollama):
+    """Ollama LLM whose generations go through the scheduler (and carry keep_alive)"""
+
+    scheduler: Optional[Any] = None
+    priority: int = INTERACTIVE
+    keep_alive: Optional[Any] = None
+
+    @property
+    def _default_params(self) -> Dict[str, Any]:
+        params = super()._default_params
+        if self.keep_alive is not None:
+            params['keep_alive'] = self.keep_alive
+        return params
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        images: Optional[List[str]] = None,
+        run_manager: Optional[Any] = None,
+        **kwargs: Any
+    ):
+        generate = super()._generate
+        if self.scheduler is None:
+            return generate(prompts, stop=stop, images=images, run_manager=run_manager, **kwargs)
+
+        return self.scheduler.run(
+            self.priority, generate, prompts,
+            stop=stop, images=images, run_manager=run_manager, **kwargs
+        )
@@ -0,0 +1,66 @@
+"""
+Nomi delle collection Chroma
+Modulo leggero e senza effetti collaterali: lo usano sia il motore RAG sia
+gli strumenti da riga di comando (snapshot) senza caricare LangChain
+"""
+
+import hashlib
+import re
+from pathlib import Path
+from typing import Dict, Optional
+
+
+EMBEDDING_MODEL = "nomic-embed-text"
+
+
+def collection_name_for(path: Path, prefix: Optional[str] = None) -> str:
+    """Chroma-safe collection name (3-63 chars) unique per folder path"""
+    digest = hashlib.sha1(str(Path(path).resolve()).encode('utf-8')).hexdigest()[:8]
+    slug = re.sub(r'[^a-zA-Z0-9_-]+', '-', prefix or Path(path).name).strip('-_')[:50]
+    return f"{slug or 'docs'}-{digest}"
+
+
+def shard_name(
+    root: Path,
+    shard_path: Path,
+    shard_by: str = "root",
+    collection_name: Optional[str] = None
+) -> str:
+    """Collection name of the shard indexing shard_path under documents root"""
+    root, shard_path = Path(root), Path(shard_path)
+
+    if shard_by == "root":
+        return collection_name or collection_name_for(root)
+
+    if shard_by != "subfolder":
+        raise ValueError(f"Unknown shard_by: {shard_by}")
+
+    base = collection_name or root.name
+    # I file direttamente nella radice hanno una shard a parte
+    if shard_path.resolve() == root.resolve():
+        return collection_name_for(root, f"{base}-root")
+    return collection_name_for(shard_path, f"{base}-{shard_path.name}")
+
+
+def shard_layout(
+    root: Path,
+    shard_by: str = "root",
+    collection_name: Optional[str] = None
+) -> Dict[str, Dict]:
+    """Map each shard (Chroma collection) name to the folder it indexes"""
+    root = Path(root)
+
+    if shard_by != "subfolder":
+        return {shard_name(root, root, shard_by, collection_name): {'path': root, 'recursive': True}}
+
+    entries = sorted(root.iterdir())
+    layout = {}
+
+    if any(p.is_file() for p in entries):
+        layout[shard_name(root, root, shard_by, collection_name)] = {'path': root, 'recursive': False}
+
+    for sub in entries:
+        if sub.is_dir():
+            layout[shard_name(root, sub, shard_by, collection_name)] = {'path': sub, 'recursive': True}
+
+    return layout
@@ -0,0 +1,365 @@
+"""
+Snapshot portabili dell'indice
+Esporta chunk, metadati e vettori (anche quantizzati) in un archivio zip
+versionato e li reimporta in un persist_directory nuovo senza ricalcolare
+gli embedding
+"""
+
+import argparse
+import io
+import json
+import shutil
+import struct
+import tempfile
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import chromadb
+import numpy as np
+
+from shards import EMBEDDING_MODEL, shard_name
+
+
+SNAPSHOT_VERSION = 1
+QUANTIZATIONS = ('float32', 'float16', 'int8')
+
+# Header locale di un membro zip: firma, versione, flag, metodo, ora, data,
+# crc, dimensioni, lunghezza nome, lunghezza extra
+_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+
+
+def _quantize(vectors: np.ndarray, quantization: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Vectors in the stored dtype, plus per-vector scales for int8"""
+    if quantization == 'float16':
+        return vectors.astype(np.float16), None
+    if quantization == 'int8':
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+    return vectors.astype(np.float32), None
+
+
+def _npy_header(shape: Tuple[int, ...], dtype: np.dtype) -> bytes:
+    buffer = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        buffer, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': shape}
+    )
+    return buffer.getvalue()
+
+
+def _stored_member(archive: zipfile.ZipFile, name: str):
+    """Open a member for streaming write without compression (memory-mappable)"""
+    info = zipfile.ZipInfo(name, date_time=datetime.now().timetuple()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    return archive.open(info, 'w', force_zip64=True)
+
+
+def _iter_collection(collection, batch_size: int) -> Iterator[Dict]:
+    for offset in range(0, collection.count(), batch_size):
+        yield collection.get(
+            include=['embeddings', 'documents', 'metadatas'],
+            limit=batch_size,
+            offset=offset
+        )
+
+
+def export_snapshot(
+    persist_directory: str,
+    archive_path: str,
+    quantization: str = 'float16',
+    collections: Optional[List[str]] = None,
+    batch_size: int = 1000
+) -> Dict:
+    """
+    Write the collections of persist_directory to a snapshot archive
+
+    Args:
+        persist_directory: Chroma folder to export (with collections.json)
+        archive_path: Output .zip file
+        quantization: 'float32' (exact), 'float16' or 'int8' (per-vector scale)
+        collections: Collections to export (default: all)
+        batch_size: Records read from Chroma at a time
+
+    Returns:
+        The snapshot manifest written to the archive
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Quantizzazione non supportata: {quantization} ({', '.join(QUANTIZATIONS)})")
+
+    client = chromadb.PersistentClient(path=str(persist_directory))
+    manifest_path = Path(persist_directory) / "collections.json"
+    shards = json.loads(manifest_path.read_text(encoding='utf-8')) if manifest_path.exists() else {}
+    names = collections or [c.name for c in client.list_collections()]
+
+    snapshot = {
+        'format': 'free-rag-snapshot',
+        'version': SNAPSHOT_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'embedding_model': EMBEDDING_MODEL,
+        'quantization': quantization,
+        'collections': {}
+    }
+
+    with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name in names:
+            collection = client.get_collection(name)
+            count = collection.count()
+            written = 0
+            dimensions = 0
+            scales = []
+            vectors_file = None
+
+            print(f"📤 {name}: {count} chunks")
+
+            # Vettori non compressi (leggibili con mmap) scritti in streaming;
+            # testo e metadati passano da un file temporaneo e vanno compressi
+            with tempfile.TemporaryFile() as records:
+                for batch in _iter_collection(collection, batch_size):
+                    if not batch['ids']:
+                        break
+
+                    vectors = np.asarray(batch['embeddings'], dtype=np.float32)
+                    stored, batch_scales = _quantize(vectors, quantization)
+
+                    if vectors_file is None:
+                        dimensions = vectors.shape[1]
+                        vectors_file = _stored_member(archive, f"{name}/vectors.npy")
+                        vectors_file.write(_npy_header((count, dimensions), stored.dtype))
+
+                    vectors_file.write(stored.tobytes())
+                    if batch_scales is not None:
+                        scales.append(batch_scales)
+
+                    for id_, document, metadata in zip(batch['ids'], batch['documents'], batch['metadatas']):
+                        line = json.dumps({'id': id_, 'document': document, 'metadata': metadata},
+                                          ensure_ascii=False)
+                        records.write((line + "\n").encode('utf-8'))
+                    written += len(batch['ids'])
+
+                if vectors_file is not None:
+                    vectors_file.close()
+
+                records.seek(0)
+                with archive.open(f"{name}/records.jsonl", 'w', force_zip64=True) as member:
+                    shutil.copyfileobj(records, member)
+
+            if written != count:
+                raise RuntimeError(f"Collection {name} modificata durante l'export ({written}/{count})")
+
+            if scales:
+                with _stored_member(archive, f"{name}/scales.npy") as scales_file:
+                    np.save(scales_file, np.concatenate(scales))
+
+            snapshot['collections'][name] = {
+                'count': count,
+                'dimensions': dimensions,
+                'metadata': collection.metadata,
+                'manifest': shards.get(name, {})
+            }
+
+        archive.writestr('snapshot.json', json.dumps(snapshot, indent=2))
+
+    size = Path(archive_path).stat().st_size
+    print(f"✅ Snapshot scritto: {archive_path} ({size / 1024 / 1024:.1f} MB, {quantization})")
+    return snapshot
+
+
+def read_snapshot_info(archive_path: str) -> Dict:
+    """Manifest of a snapshot archive, checking its format version"""
+    with zipfile.ZipFile(archive_path) as archive:
+        snapshot = json.loads(archive.read('snapshot.json'))
+
+    if snapshot.get('format') != 'free-rag-snapshot':
+        raise ValueError(f"{archive_path} non è uno snapshot dell'indice")
+    if snapshot.get('version', 0) > SNAPSHOT_VERSION:
+        raise ValueError(f"Snapshot versione {snapshot['version']} non supportata "
+                         f"(massimo {SNAPSHOT_VERSION}): aggiorna il codice")
+    return snapshot
+
+
+def _map_member(archive_path: str, archive: zipfile.ZipFile, name: str) -> np.ndarray:
+    """Memory-map a stored .npy member in place (no extraction)"""
+    info = archive.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED:
+        return np.load(io.BytesIO(archive.read(name)))
+
+    with open(archive_path, 'rb') as raw:
+        raw.seek(info.header_offset)
+        header = _LOCAL_HEADER.unpack(raw.read(_LOCAL_HEADER.size))
+        start = info.header_offset + _LOCAL_HEADER.size + header[-2] + header[-1]
+
+        raw.seek(start)
+        np.lib.format.read_magic(raw)
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(raw)
+        offset = raw.tell()
+
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(archive_path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+def _shard_config(name: str, entry: Dict) -> Tuple[str, Optional[str]]:
+    """(shard_by, collection_name) the exporting engine used for this shard"""
+    if 'shard_by' in entry:
+        return entry['shard_by'], entry.get('collection_name')
+
+    # Manifest precedenti: si ricava dal nome della collection
+    root, shard_path = Path(entry['documents_path']), Path(entry['shard_path'])
+    for shard_by in ('root', 'subfolder'):
+        if shard_name(root, shard_path, shard_by) == name:
+            return shard_by, None
+    if shard_path == root and not name.rsplit('-', 1)[0].endswith('-root'):
+        return 'root', name
+    suffix = '-root' if shard_path == root else f"-{shard_path.name}"
+    return 'subfolder', name.rsplit('-', 1)[0][:-len(suffix)] or None
+
+
+def relocated_name(name: str, entry: Dict, documents_path: Path) -> str:
+    """Collection name the engine computes for this shard under documents_path"""
+    shard_by, collection_name = _shard_config(name, entry)
+    relative = Path(entry['shard_path']).relative_to(entry['documents_path'])
+    return shard_name(Path(documents_path), Path(documents_path) / relative, shard_by, collection_name)
+
+
+def relocated_source(source: str, old_roots: List[str], new_root: str) -> str:
+    """Chunk source with the old documents folder prefix replaced by the new one"""
+    for old_root in old_roots:
+        for sep in ('/', '\\'):
+            prefix = old_root.rstrip(sep) + sep
+            if source.startswith(prefix):
+                return str(Path(new_root) / Path(*source[len(prefix):].split(sep)))
+    return source
+
+
+def import_snapshot(
+    archive_path: str,
+    persist_directory: str,
+    documents_path: Optional[str] = None,
+    batch_size: int = 1000
+) -> Dict[str, str]:
+    """
+    Load a snapshot into persist_directory without re-embedding
+
+    Existing collections with the same name are replaced. With
+    documents_path the shards are remapped to that folder: collection
+    names follow shard_layout() for the new root and chunk sources are
+    rewritten, so initialize() and update_shard() reuse them.
+
+    Returns:
+        Mapping snapshot collection name -> imported collection name
+    """
+    snapshot = read_snapshot_info(archive_path)
+
+    if snapshot['embedding_model'] != EMBEDDING_MODEL:
+        print(f"⚠️  Snapshot creato con {snapshot['embedding_model']}, "
+              f"le query useranno {EMBEDDING_MODEL}")
+
+    client = chromadb.PersistentClient(path=str(persist_directory))
+    manifest_path = Path(persist_directory) / "collections.json"
+    shards = json.loads(manifest_path.read_text(encoding='utf-8')) if manifest_path.exists() else {}
+    imported = {}
+
+    with zipfile.ZipFile(archive_path) as archive:
+        for name, info in snapshot['collections'].items():
+            entry = dict(info.get('manifest') or {})
+            target = name
+            old_roots = []
+
+            if documents_path and entry.get('shard_path') and entry.get('documents_path'):
+                # I source sono scritti col percorso passato al motore (anche relativo)
+                old_roots = [root for root in (entry.get('source_root'), entry['documents_path']) if root]
+                relative = Path(entry['shard_path']).relative_to(entry['documents_path'])
+                target = relocated_name(name, entry, documents_path)
+                entry['shard_by'], entry['collection_name'] = _shard_config(name, entry)
+                entry['documents_path'] = str(Path(documents_path).resolve())
+                entry['shard_path'] = str((Path(documents_path) / relative).resolve())
+                entry['source_root'] = str(Path(documents_path))
+
+            print(f"📥 {name} → {target}: {info['count']} chunks")
+
+            try:
+                client.delete_collection(target)
+            except ValueError:
+                pass
+            collection = client.get_or_create_collection(target, metadata=info.get('metadata'))
+
+            if info['count']:
+                vectors = _map_member(archive_path, archive, f"{name}/vectors.npy")
+                scales = None
+                if snapshot['quantization'] == 'int8':
+                    scales = _map_member(archive_path, archive, f"{name}/scales.npy")
+
+                with archive.open(f"{name}/records.jsonl") as records:
+                    lines = io.TextIOWrapper(records, encoding='utf-8')
+                    start = 0
+                    while start < info['count']:
+                        batch = [json.loads(next(lines)) for _ in range(min(batch_size, info['count'] - start))]
+
+                        if old_roots:
+                            for r in batch:
+                                if 'source' in (r['metadata'] or {}):
+                                    r['metadata']['source'] = relocated_source(
+                                        r['metadata']['source'], old_roots, documents_path)
+
+                        block = np.asarray(vectors[start:start + len(batch)], dtype=np.float32)
+                        if scales is not None:
+                            block *= scales[start:start + len(batch), None]
+
+                        collection.add(
+                            ids=[r['id'] for r in batch],
+                            embeddings=block.tolist(),
+                            metadatas=[r['metadata'] for r in batch],
+                            documents=[r['document'] for r in batch]
+                        )
+                        start += len(batch)
+
+            entry['chunks'] = info['count']
+            entry['imported'] = datetime.now().isoformat(timespec='seconds')
+            shards[target] = entry
+            imported[name] = target
+
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    manifest_path.write_text(json.dumps(shards, indent=2), encoding='utf-8')
+
+    print(f"✅ Importate {len(imported)} collection in {persist_directory}")
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export/import dell'indice Chroma senza ricalcolare gli embedding")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help="Scrive uno snapshot")
+    export.add_argument('archive')
+    export.add_argument('--persist-directory', default='./chroma_db')
+    export.add_argument('--quantization', choices=QUANTIZATIONS, default='float16')
+    export.add_argument('--collections', nargs='*')
+
+    load = commands.add_parser('import', help="Carica uno snapshot")
+    load.add_argument('archive')
+    load.add_argument('--persist-directory', default='./chroma_db')
+    load.add_argument('--documents-path', help="Cartella dei documenti su questa macchina")
+
+    show = commands.add_parser('info', help="Mostra il contenuto di uno snapshot")
+    show.add_argument('archive')
+
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export_snapshot(args.persist_directory, args.archive, args.quantization, args.collections)
+    elif args.command == 'import':
+        import_snapshot(args.archive, args.persist_directory, args.documents_path)
+    else:
+        snapshot = read_snapshot_info(args.archive)
+        print(f"📦 Snapshot v{snapshot['version']} del {snapshot['created']} "
+              f"({snapshot['embedding_model']}, {snapshot['quantization']})")
+        for name, info in snapshot['collections'].items():
+            print(f"   - {name}: {info['count']} chunks × {info['dimensions']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import os
+
+from analyzer_folder import file_cost_minutes, plan_batches, scan_folder
+
+
+def _write(path, size):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+
+
+def test_plan_batches_balances_cost():
+    files = [
+        {'path': f"/d/f{i}.pdf", 'extension': '.pdf', 'size': size}
+        for i, size in enumerate([9_000_000, 7_000_000, 5_000_000, 3_000_000, 2_000_000, 1_000_000])
+    ] + [{'path': "/d/log.gz", 'extension': '.gz', 'size': 50_000_000}]
+
+    plan = plan_batches(files, 2)
+
+    assert [b['batch'] for b in plan] == [1, 2]
+    planned = [f['path'] for b in plan for f in b['files']]
+    assert sorted(planned) == sorted(f"/d/f{i}.pdf" for i in range(6))  # .gz non supportato
+    assert sum(b['size'] for b in plan) == 27_000_000
+    costs = [b['minutes'] for b in plan]
+    assert max(costs) - min(costs) <= file_cost_minutes(1_000_000) + 1e-9
+
+
+def test_plan_batches_more_batches_than_files():
+    plan = plan_batches([{'path': "/d/a.txt", 'extension': '.txt', 'size': 10}], 3)
+
+    assert [len(b['files']) for b in plan] == [1, 0, 0]
+
+
+def test_scan_folder_cache_invalidation(tmp_path):
+    docs, cache = tmp_path / "docs", tmp_path / "cache"
+    _write(docs / "a.pdf", 10)
+    _write(docs / "sub" / "b.txt", 20)
+    _write(docs / "sub" / "deep" / "c.docx", 30)
+
+    files, info = scan_folder(str(docs), cache_dir=str(cache))
+    assert info['directories'] == 3 and info['rescanned_directories'] == 3
+    assert sorted(f['extension'] for f in files) == ['.docx', '.pdf', '.txt']
+
+    # Nessuna modifica: tutto dalla cache
+    files, info = scan_folder(str(docs), cache_dir=str(cache))
+    assert info['rescanned_directories'] == 0
+    assert len(files) == 3
+
+    # Un file nuovo cambia l'mtime della sola cartella che lo contiene
+    _write(docs / "sub" / "d.tar.gz", 40)
+    stat = os.stat(docs / "sub")
+    os.utime(docs / "sub", (stat.st_atime, stat.st_mtime + 5))
+    files, info = scan_folder(str(docs), cache_dir=str(cache))
+    assert info['rescanned_directories'] == 1
+    assert {f['extension'] for f in files if f['path'].endswith("d.tar.gz")} == {'.tar.gz'}
+
+    # Senza cache_dir si rilegge sempre tutto
+    _, info = scan_folder(str(docs))
+    assert info['rescanned_directories'] == 3
@@ -0,0 +1,75 @@
+import io
+import zipfile
+
+from archives import archive_extension, iter_members, member_filename
+
+
+def _zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+MBOX = b"""From mario@example.it Mon Jan  1 10:00:00 2024
+Message-ID: <contratto/1@example.it>
+From: mario@example.it
+Subject: Contratto
+
+Il contratto scade a marzo.
+>From qui in poi la riga era escapata.
+From anna@example.it Tue Jan  2 10:00:00 2024
+From: anna@example.it
+Subject: Senza id
+
+Secondo messaggio.
+"""
+
+
+def test_nested_zip_members():
+    inner = _zip({'nota.txt': b"interno", 'foto.jpg': b"\xff\xd8"})
+    outer = _zip({'a.txt': b"esterno", 'sub/dentro.zip': inner, 'b.bin': b"x"})
+
+    members = dict(iter_members('archivio.zip', io.BytesIO(outer), ('.txt',)))
+
+    assert members == {
+        'archivio.zip::a.txt': b"esterno",
+        'archivio.zip::sub/dentro.zip::nota.txt': b"interno",
+    }
+    assert member_filename('archivio.zip::sub/dentro.zip::nota.txt') == 'nota.txt'
+
+
+def test_mbox_messages_keyed_on_message_id():
+    members = dict(iter_members('posta.mbox', io.BytesIO(MBOX), ('.txt',)))
+    keyed = 'posta.mbox::messaggio-contratto_1@example.it.eml::messaggio.txt'
+
+    assert keyed in members
+    (other,) = set(members) - {keyed}  # senza Message-ID: hash del contenuto
+    assert other.startswith('posta.mbox::messaggio-') and other.endswith('.eml::messaggio.txt')
+    body = members[keyed].decode('utf-8')
+    assert "Oggetto: Contratto" in body
+    assert "\nFrom qui in poi" in body
+
+
+def test_mbox_keys_stable_when_messages_are_added():
+    before = set(dict(iter_members('posta.mbox', io.BytesIO(MBOX), ('.txt',))))
+    extra = b"From x@example.it Mon Jan  1 09:00:00 2024\nMessage-ID: <nuovo@example.it>\n\nNuovo.\n"
+    after = set(dict(iter_members('posta.mbox', io.BytesIO(extra + MBOX), ('.txt',))))
+
+    assert before < after
+    assert len(after - before) == 1
+
+
+def test_mbox_in_zip():
+    archive = _zip({'caselle/posta.mbox': MBOX})
+
+    sources = [s for s, _ in iter_members('export.zip', io.BytesIO(archive), ('.txt',))]
+
+    assert len(sources) == 2
+    assert all(s.startswith('export.zip::caselle/posta.mbox::messaggio-') for s in sources)
+
+
+def test_archive_extension_is_multi_suffix():
+    assert archive_extension('dati.TAR.GZ') == '.tar.gz'
+    assert archive_extension('log.gz') is None
@@ -0,0 +1,90 @@
+import pytest
+from langchain.embeddings.base import Embeddings
+
+from rag_free_ollama import CHAT_PREFIX, FreeLocalRAG
+
+
+class KeywordEmbeddings(Embeddings):
+    """Same vector for every text about the contract, another for the rest"""
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [1.0, 0.0, 0.1] if 'contratto' in text.lower() else [0.0, 1.0, 0.1]
+
+
+class StubLLM:
+    def __init__(self):
+        self.prompts = []
+
+    def invoke(self, prompt, stop=None):
+        self.prompts.append(prompt)
+        if prompt.endswith("Domanda autonoma:"):
+            return "Chi ha firmato il contratto?"
+        return "risposta"
+
+
+@pytest.fixture
+def rag(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "contratto.txt").write_text("Il contratto scade a marzo ed è firmato da Rossi.", encoding='utf-8')
+    (docs / "ferie.txt").write_text("Le ferie si chiedono con un mese di anticipo.", encoding='utf-8')
+
+    engine = FreeLocalRAG(str(docs), persist_directory=str(tmp_path / "db"), ocr=False, preload=False)
+    engine.embeddings = KeywordEmbeddings()
+    engine.setup_qa_chain = lambda: None
+    assert engine.initialize()
+    engine.stub = StubLLM()
+    engine._llm_for = lambda model_name=None: engine.stub
+    return engine
+
+
+def test_follow_up_reuses_context_and_prefix(rag):
+    conversation = rag.start_conversation()
+
+    first = rag.chat("Quando scade il contratto?", conversation)
+    second = rag.chat("E chi l'ha firmato?", conversation)
+
+    assert not first['reused_context']
+    assert second['reused_context']
+    assert second['standalone_question'] == "Chi ha firmato il contratto?"
+    first_prompt, condense_prompt, answer_prompt = rag.stub.prompts
+    # Riformulazione e risposta condividono tutto il primo turno come prefisso
+    assert condense_prompt.startswith(first_prompt + " risposta")
+    assert answer_prompt.startswith(first_prompt + " risposta")
+    assert answer_prompt.endswith("Domanda: E chi l'ha firmato?\nRisposta:")
+    assert "Contesto aggiuntivo" not in answer_prompt
+
+
+def test_changed_shards_are_searched_again(rag):
+    conversation = rag.start_conversation()
+    shards = list(rag.shard_layout())
+
+    rag.chat("Quando scade il contratto?", conversation)
+    result = rag.chat("E chi l'ha firmato?", conversation, shards=shards)
+
+    assert not result['reused_context']
+
+
+def test_reset_uses_the_standalone_question(rag):
+    conversation = rag.start_conversation()
+    rag.chat("Quando scade il contratto?", conversation)
+    rag.max_chat_tokens = 40  # il secondo turno non ci sta più
+
+    rag.chat("E chi l'ha firmato?", conversation)
+
+    answer_prompt = rag.stub.prompts[-1]
+    assert answer_prompt.startswith(CHAT_PREFIX + "Contesto:\n")
+    assert answer_prompt.endswith("Domanda: Chi ha firmato il contratto?\nRisposta:")
+    assert "E chi l'ha firmato?" not in answer_prompt
+    assert rag.conversations[conversation]['transcript'].startswith("Contesto:\n")
+
+
+def test_chat_budget_follows_num_ctx(tmp_path):
+    engine = FreeLocalRAG(str(tmp_path), persist_directory=str(tmp_path / "db"),
+                          ocr=False, preload=False, num_ctx=8192)
+
+    assert engine.llm.num_ctx == 8192
+    assert 6000 < engine.max_chat_tokens < 8192
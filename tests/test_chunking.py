@@ -0,0 +1,89 @@
+import pytest
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from chunking import SEPARATORS, _split_one, merge_stats, resolve_chunking, split_documents
+
+
+def length(text):
+    return len(text.split())
+
+
+def _splitter(chunk_size, chunk_overlap):
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=length,
+        separators=SEPARATORS, add_start_index=True
+    )
+
+
+def test_split_one_merges_tiny_trailing_fragment():
+    text = " ".join(f"w{i}" for i in range(22))
+    doc = Document(page_content=text, metadata={'source': 'a.txt'})
+
+    chunks, _ = _split_one(doc, _splitter(10, 0), length, min_chunk_size=5)
+
+    # 10 + 10 + 2: le ultime due parole finiscono nel chunk precedente
+    assert [length(c.page_content) for c in chunks] == [10, 12]
+    assert chunks[-1].page_content.endswith("w21")
+    assert all(c.metadata['source'] == 'a.txt' for c in chunks)
+
+
+def test_split_one_counts_overlap_bytes():
+    text = " ".join(f"w{i}" for i in range(30))
+    doc = Document(page_content=text, metadata={'source': 'a.txt'})
+
+    chunks, overlap = _split_one(doc, _splitter(10, 3), length, min_chunk_size=1)
+
+    expected = 0
+    for prev, cur in zip(chunks, chunks[1:]):
+        prev_end = prev.metadata['start_index'] + len(prev.page_content)
+        expected += len(text[cur.metadata['start_index']:prev_end].encode('utf-8'))
+    assert len(chunks) > 1
+    assert overlap == expected > 0
+
+
+def test_split_one_keeps_page_whole_up_to_page_size():
+    doc = Document(page_content="parola " * 50, metadata={'source': 'a.pdf', 'page': 3})
+
+    whole, overlap = _split_one(doc, _splitter(10, 2), length, min_chunk_size=1, page_size=60)
+    split, _ = _split_one(doc, _splitter(10, 2), length, min_chunk_size=1, page_size=40)
+
+    assert len(whole) == 1 and overlap == 0
+    assert whole[0].metadata['page'] == 3
+    assert len(split) > 1
+
+
+def test_merge_stats_matches_single_split():
+    docs = [
+        Document(page_content="testo di prova " * (20 + i), metadata={'source': f"doc-{i}.txt"})
+        for i in range(6)
+    ] + [Document(page_content="pagina pdf " * 30, metadata={'source': 'a.pdf'})]
+
+    _, whole = split_documents(docs)
+    _, first = split_documents(docs[:3])
+    _, second = split_documents(docs[3:])
+    merged = merge_stats(merge_stats({}, first), second)
+
+    assert merged['total'] == pytest.approx(whole['total'])
+    for ext, data in whole['by_extension'].items():
+        assert merged['by_extension'][ext] == pytest.approx(data)
+
+
+def test_resolve_chunking_rejects_unknown_strategy():
+    assert resolve_chunking({'.TXT': {'chunk_size': 50}})['.txt']['chunk_size'] == 50
+    with pytest.raises(ValueError):
+        resolve_chunking({'.pdf': {'strategy': 'pagina'}})
+
+
+def test_blank_pages_produce_no_chunks():
+    docs = [
+        Document(page_content="", metadata={'source': 'scansione.pdf', 'page': 0}),
+        Document(page_content=" \n\t ", metadata={'source': 'scansione.pdf', 'page': 1}),
+        Document(page_content="testo vero", metadata={'source': 'nota.txt'}),
+    ]
+
+    chunks, stats = split_documents(docs)
+
+    assert [c.page_content for c in chunks] == ["testo vero"]
+    assert '.pdf' not in stats['by_extension']
+    assert _split_one(docs[1], _splitter(10, 0), length, min_chunk_size=1, page_size=500) == ([], 0)
@@ -0,0 +1,102 @@
+import threading
+import time
+
+from langchain.embeddings.base import Embeddings
+
+from rag_free_ollama import FreeLocalRAG
+
+
+class SlowEmbeddings(Embeddings):
+    """Deterministic vectors, slow enough for index runs to overlap"""
+
+    def embed_documents(self, texts):
+        time.sleep(0.05)
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text) % 7), 1.0, 0.5]
+
+
+def _engine(docs, persist_directory, **kwargs):
+    engine = FreeLocalRAG(str(docs), persist_directory=str(persist_directory),
+                          ocr=False, preload=False, **kwargs)
+    engine.embeddings = SlowEmbeddings()
+    engine.setup_qa_chain = lambda: None
+    engine.embed_batch_size = 8
+    return engine
+
+
+def _documents(folder, count=20):
+    folder.mkdir(parents=True, exist_ok=True)
+    for i in range(count):
+        (folder / f"doc-{i}.txt").write_text(f"Documento numero {i} con un po' di testo.", encoding='utf-8')
+
+
+def _run_together(*targets):
+    threads = [threading.Thread(target=target) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+
+def test_concurrent_reindex_does_not_duplicate_chunks(tmp_path):
+    _documents(tmp_path / "docs")
+    rag = _engine(tmp_path / "docs", tmp_path / "db")
+    assert rag.initialize()
+    name = next(iter(rag.shards))
+    expected = rag.client.get_collection(name).count()
+
+    (tmp_path / "docs" / "doc-0.txt").write_text("Documento cambiato.", encoding='utf-8')
+    _run_together(lambda: rag.update_shard(name), lambda: rag.update_shard(name),
+                  lambda: rag.index_shard(name))
+
+    assert rag.client.get_collection(name).count() == expected
+
+
+def test_search_survives_a_rebuild(tmp_path):
+    _documents(tmp_path / "docs")
+    rag = _engine(tmp_path / "docs", tmp_path / "db")
+    assert rag.initialize()
+    name = next(iter(rag.shards))
+    errors = []
+    done = threading.Event()
+
+    def search_loop():
+        while not done.is_set():
+            try:
+                rag.search_shards("documento", k=3, embedding=[1.0, 1.0, 0.5])
+            except Exception as e:
+                errors.append(e)
+
+    def rebuild():
+        rag.index_shard(name)
+        done.set()
+
+    _run_together(search_loop, rebuild)
+
+    assert errors == []
+    assert len(rag.search_shards("documento", k=3, embedding=[1.0, 1.0, 0.5])) == 3
+
+
+def test_initialize_in_background_is_idempotent(tmp_path):
+    _documents(tmp_path / "docs", count=5)
+    rag = _engine(tmp_path / "docs", tmp_path / "db")
+
+    first = rag.initialize_in_background()
+    second = rag.initialize_in_background()
+    first.join(30)
+
+    assert first is second
+    assert rag.ready
+
+
+def test_manifest_keeps_entries_of_concurrent_engines(tmp_path):
+    _documents(tmp_path / "docs" / "a", count=5)
+    _documents(tmp_path / "docs" / "b", count=5)
+    engines = [_engine(tmp_path / "docs", tmp_path / "db", shard_by="subfolder") for _ in range(2)]
+    names = sorted(engines[0].shard_layout())
+
+    _run_together(lambda: engines[0].index_shard(names[0]), lambda: engines[1].index_shard(names[1]))
+
+    assert sorted(engines[0].load_manifest()) == names
@@ -0,0 +1,86 @@
+import pytest
+from langchain.schema import Document
+
+from memory import MIN_BUFFER_BYTES, MemoryGovernor, SpillBuffer, parse_size
+
+
+def _doc(i):
+    return Document(page_content=f"testo {i} " * 20, metadata={'source': f"doc-{i}.txt", 'n': i})
+
+
+@pytest.fixture
+def governor():
+    governor = MemoryGovernor(min_available=None, interval=60)
+    governor.buffer_bytes = lambda: 2000  # pochi documenti in memoria, poi su disco
+    return governor
+
+
+def test_spill_buffer_keeps_insertion_order(governor, tmp_path):
+    buffer = SpillBuffer(governor, str(tmp_path / "spill"))
+    buffer.extend(_doc(i) for i in range(23))
+
+    assert buffer._spilled > 0 and buffer._memory  # parte su disco, parte in memoria
+    assert len(buffer) == 23
+    assert [d.metadata['n'] for d in buffer] == list(range(23))
+    assert [d.metadata['n'] for d in buffer] == list(range(23))  # iterabile più volte
+    assert governor.stats['spills'] >= 1 and governor.stats['spilled_bytes'] > 0
+    assert next(iter(buffer)).page_content == _doc(0).page_content
+
+
+def test_spill_buffer_append_while_iterating(governor, tmp_path):
+    buffer = SpillBuffer(governor, str(tmp_path / "spill"))
+    buffer.extend(_doc(i) for i in range(10))
+
+    seen = []
+    for doc in buffer:
+        seen.append(doc.metadata['n'])
+        if len(seen) == 3:
+            buffer.extend(_doc(i) for i in range(10, 20))  # forza altri spill
+
+    assert seen[:10] == list(range(10))
+    assert len(buffer) == 20
+
+
+def test_spill_buffer_close_releases_everything(governor, tmp_path):
+    buffer = SpillBuffer(governor, str(tmp_path / "spill"))
+    buffer.extend(_doc(i) for i in range(25))
+    spill_file = buffer._file
+
+    buffer.close()
+
+    assert spill_file.closed
+    assert list(buffer) == []
+
+
+def test_governor_scales_with_pressure():
+    governor = MemoryGovernor(min_available=None, interval=60)
+
+    governor.pressure = lambda: 0.5
+    assert governor.scale(8) == 8
+    governor.pressure = lambda: 0.9
+    assert governor.scale(8) == 4
+    governor.pressure = lambda: 1.2
+    assert governor.scale(8) == 2
+    assert governor.scale(2, minimum=1) == 1
+    assert governor.buffer_bytes() == MIN_BUFFER_BYTES
+    assert governor.stats['throttled'] == 3
+
+
+def test_governor_stage_records_peak():
+    governor = MemoryGovernor("64GB", min_available=None, interval=60)
+
+    with governor.stage('parse'):
+        data = bytearray(16 * 1024 * 1024)
+    del data
+
+    assert governor.peaks['parse'] > 0
+    assert governor.report()['budget'] == 64 * 1024 ** 3
+
+
+def test_parse_size():
+    assert parse_size("2GB") == 2 * 1024 ** 3
+    assert parse_size("512m") == 512 * 1024 ** 2
+    assert parse_size(1000) == 1000
+    assert parse_size(None) is None
+    with pytest.raises(ValueError):
+        parse_size("molto")
@@ -0,0 +1,73 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import ocr
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    calls = []
+    release = threading.Event()
+
+    def fake_ocr(page_pdf, lang, dpi):
+        calls.append(page_pdf)
+        release.wait(5)
+        return page_pdf.decode() + " letto", 0.1
+
+    # Thread al posto dei processi: la funzione finta resta visibile
+    monkeypatch.setattr(ocr, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(ocr, '_ocr_page', fake_ocr)
+    pool = ocr.OCRPool(str(tmp_path / "cache"), max_workers=2)
+    pool.calls, pool.release = calls, release
+    yield pool
+    release.set()
+    pool.shutdown()
+
+
+def test_same_page_is_ocred_once(pool):
+    first = pool.submit(b"pagina")
+    second = pool.submit(b"pagina")
+    pool.release.set()
+
+    assert first is second
+    assert first.result(5) == "pagina letto"
+    assert pool.submit(b"pagina").result(5) == "pagina letto"  # dalla cache su disco
+    assert pool.calls == [b"pagina"]
+    assert pool.stats['pages'] == 3 and pool.stats['cache_hits'] == 2
+    assert not pool._pending
+
+
+def test_cache_write_failure_still_resolves(pool, monkeypatch):
+    def broken_replace(src, dst):
+        raise OSError("disco pieno")
+
+    monkeypatch.setattr(ocr.os, 'replace', broken_replace)
+    pool.release.set()
+
+    assert pool.submit(b"pagina").result(5) == "pagina letto"
+    assert not pool._pending
+    # Nessuna cache: la pagina torna in OCR invece di restare appesa
+    assert pool.submit(b"pagina").result(5) == "pagina letto"
+    assert len(pool.calls) == 2
+
+
+def test_ocr_error_is_raised_and_released(pool, monkeypatch):
+    def failing_ocr(page_pdf, lang, dpi):
+        raise RuntimeError("tesseract assente")
+
+    monkeypatch.setattr(ocr, '_ocr_page', failing_ocr)
+
+    with pytest.raises(RuntimeError):
+        pool.submit(b"pagina").result(5)
+    assert not pool._pending
+
+
+def test_pool_restarts_after_shutdown(pool):
+    pool.release.set()
+    pool.submit(b"uno").result(5)
+    pool.shutdown()
+    assert pool._executor is None
+
+    assert pool.submit(b"due").result(5) == "due letto"
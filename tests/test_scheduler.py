@@ -0,0 +1,92 @@
+import threading
+import time
+
+from scheduler import BACKGROUND, INTERACTIVE, OllamaScheduler, ScheduledEmbeddings
+
+
+def _blocker(scheduler):
+    """Occupy the single worker until the returned event is set"""
+    started, release = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    future = scheduler.submit(BACKGROUND, block)
+    assert started.wait(5)
+    return release, future
+
+
+def test_interactive_jobs_run_before_queued_background_jobs():
+    scheduler = OllamaScheduler(workers=1, max_backoff=0.05, latency_target=10)
+    order = []
+    release, blocker = _blocker(scheduler)
+
+    jobs = [scheduler.submit(BACKGROUND, order.append, f"indice-{i}") for i in range(3)]
+    jobs.append(scheduler.submit(INTERACTIVE, order.append, "domanda"))
+    release.set()
+    for job in [blocker] + jobs:
+        job.result(5)
+
+    assert order == ["domanda", "indice-0", "indice-1", "indice-2"]
+    report = scheduler.report()
+    assert report['interactive']['completed'] == 1
+    assert report['background']['completed'] == 4
+    assert report['background']['queued'] == 0
+
+
+def test_throttled_background_job_is_requeued_behind_new_query():
+    # Latenza interattiva oltre il target: i job di indicizzazione vengono rallentati
+    scheduler = OllamaScheduler(workers=1, latency_target=0.001, max_backoff=0.6, cooldown=30)
+    release, blocker = _blocker(scheduler)
+    slow_query = scheduler.submit(INTERACTIVE, lambda: None)
+    time.sleep(0.1)
+    release.set()
+    blocker.result(5)
+    slow_query.result(5)
+
+    order = []
+    background = scheduler.submit(BACKGROUND, order.append, "indice")
+    time.sleep(0.15)  # il worker sta aspettando prima del job in background
+    query = scheduler.submit(INTERACTIVE, order.append, "domanda")
+    query.result(5)
+    background.result(5)
+
+    assert order == ["domanda", "indice"]
+    assert scheduler.report()['background']['throttled'] >= 1
+
+
+def test_exceptions_reach_the_caller():
+    scheduler = OllamaScheduler(workers=1)
+
+    def fail():
+        raise RuntimeError("ollama non risponde")
+
+    future = scheduler.submit(INTERACTIVE, fail)
+
+    assert isinstance(future.exception(5), RuntimeError)
+    assert scheduler.report()['interactive']['completed'] == 1
+
+
+class RecordingEmbeddings:
+    def __init__(self):
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        return [[float(len(t))] for t in texts]
+
+    def embed_query(self, text):
+        return [0.0]
+
+
+def test_scheduled_embeddings_split_documents_in_sub_batches():
+    inner = RecordingEmbeddings()
+    embeddings = ScheduledEmbeddings(inner, OllamaScheduler(workers=2), sub_batch=3)
+    texts = [f"t{'x' * i}" for i in range(8)]
+
+    vectors = embeddings.embed_documents(texts)
+
+    assert vectors == [[float(len(t))] for t in texts]
+    assert sorted(len(batch) for batch in inner.batches) == [2, 3, 3]
+    assert embeddings.embed_query("domanda") == [0.0]
@@ -0,0 +1,63 @@
+from langchain.embeddings.base import Embeddings
+
+from highlight import highlight_spans, make_snippet, query_terms
+from rag_free_ollama import FreeLocalRAG
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.queries = 0
+
+    def embed_documents(self, texts):
+        return [[float(i % 5), 1.0, float(len(t) % 3)] for i, t in enumerate(texts)]
+
+    def embed_query(self, text):
+        self.queries += 1
+        return [1.0, 1.0, 1.0]
+
+
+def test_query_terms_skip_stopwords_and_short_words():
+    assert query_terms("Quando scade il contratto di affitto?") == ['contratto', 'affitto', 'scade']
+
+
+def test_highlight_spans_merge_overlaps():
+    text = "Il contratto di locazione, contrattuale."
+
+    assert highlight_spans(text, ['contratto', 'contrattuale']) == [(3, 12), (27, 39)]
+    assert highlight_spans(text, ['locazione', 'azione']) == [(16, 25)]
+    assert highlight_spans(text, []) == []
+
+
+def test_make_snippet_marks_matches_in_window():
+    text = "x" * 500 + " il contratto scade " + "y" * 500
+    spans = highlight_spans(text, ['contratto'])
+
+    snippet = make_snippet(text, spans, width=100)
+
+    assert "**contratto**" in snippet
+    assert snippet.startswith("…") and snippet.endswith("…")
+    assert make_snippet("breve", []) == "breve"
+
+
+def test_search_pages_reuse_the_cached_hits(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for i in range(12):
+        (docs / f"contratto-{i}.txt").write_text(f"Il contratto numero {i} scade a marzo.", encoding='utf-8')
+
+    rag = FreeLocalRAG(str(docs), persist_directory=str(tmp_path / "db"), ocr=False, preload=False)
+    rag.embeddings = CountingEmbeddings()
+    rag.setup_qa_chain = lambda: None
+    assert rag.initialize()
+
+    first = rag.search("contratto", page=1, page_size=5)
+    third = rag.search("contratto", page=3, page_size=5)
+
+    assert rag.embeddings.queries == 1  # la seconda pagina non ricalcola l'embedding
+    assert first['total'] == 12 and first['pages'] == 3
+    assert [r['rank'] for r in first['results']] == [1, 2, 3, 4, 5]
+    assert [r['rank'] for r in third['results']] == [11, 12]
+    distances = [r['distance'] for r in first['results']]
+    assert distances == sorted(distances)
+    assert all("**contratto**" in r['snippet'].lower() for r in first['results'])
+    assert len({r['source'] for r in first['results'] + third['results']}) == 7
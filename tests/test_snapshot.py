@@ -0,0 +1,76 @@
+import json
+import zipfile
+
+import chromadb
+import numpy as np
+import pytest
+
+from snapshot import _map_member, export_snapshot, import_snapshot, read_snapshot_info
+
+
+def _make_index(persist_directory, vectors):
+    client = chromadb.PersistentClient(path=str(persist_directory))
+    collection = client.create_collection("caso-12345678")
+    collection.add(
+        ids=[f"id-{i}" for i in range(len(vectors))],
+        embeddings=vectors.tolist(),
+        documents=[f"testo {i}" for i in range(len(vectors))],
+        metadatas=[{'source': f"/srv/share/caso/doc-{i}.txt", 'page': i} for i in range(len(vectors))]
+    )
+    (persist_directory / "collections.json").write_text(json.dumps({
+        "caso-12345678": {'documents_path': "/srv/share/caso", 'shard_path': "/srv/share/caso",
+                          'shard_by': 'root', 'collection_name': "caso-12345678", 'chunks': len(vectors)}
+    }), encoding='utf-8')
+
+
+@pytest.mark.parametrize("quantization,tolerance", [('float32', 1e-6), ('float16', 1e-2), ('int8', 5e-2)])
+def test_round_trip(tmp_path, quantization, tolerance):
+    vectors = np.random.default_rng(0).normal(size=(25, 16)).astype(np.float32)
+    _make_index(tmp_path / "db", vectors)
+
+    archive_path = tmp_path / "snap.zip"
+    export_snapshot(tmp_path / "db", archive_path, quantization=quantization, batch_size=10)
+    imported = import_snapshot(archive_path, tmp_path / "db2", batch_size=7)
+
+    assert imported == {"caso-12345678": "caso-12345678"}
+    collection = chromadb.PersistentClient(path=str(tmp_path / "db2")).get_collection("caso-12345678")
+    data = collection.get(include=['embeddings', 'documents', 'metadatas'])
+    order = np.argsort([int(i.split('-')[1]) for i in data['ids']])
+    restored = np.asarray(data['embeddings'], dtype=np.float32)[order]
+
+    assert np.abs(restored - vectors).max() < tolerance
+    assert [data['documents'][i] for i in order] == [f"testo {i}" for i in range(25)]
+
+
+@pytest.mark.parametrize("quantization,dtype", [('float32', np.float32), ('float16', np.float16), ('int8', np.int8)])
+def test_map_member_reads_npy_header(tmp_path, quantization, dtype):
+    vectors = np.random.default_rng(1).normal(size=(4, 8)).astype(np.float32)
+    _make_index(tmp_path / "db", vectors)
+    archive_path = tmp_path / "snap.zip"
+    export_snapshot(tmp_path / "db", archive_path, quantization=quantization)
+
+    with zipfile.ZipFile(archive_path) as archive:
+        mapped = _map_member(archive_path, archive, "caso-12345678/vectors.npy")
+        assert mapped.dtype == dtype
+        assert mapped.shape == (4, 8)
+        assert archive.getinfo("caso-12345678/vectors.npy").compress_type == zipfile.ZIP_STORED
+    assert read_snapshot_info(archive_path)['quantization'] == quantization
+
+
+def test_import_relocates_names_and_sources(tmp_path):
+    vectors = np.ones((2, 4), dtype=np.float32)
+    _make_index(tmp_path / "db", vectors)
+    manifest = json.loads((tmp_path / "db" / "collections.json").read_text(encoding='utf-8'))
+    manifest["caso-12345678"]['collection_name'] = None  # nome derivato dalla cartella
+    (tmp_path / "db" / "collections.json").write_text(json.dumps(manifest), encoding='utf-8')
+
+    archive_path = tmp_path / "snap.zip"
+    export_snapshot(tmp_path / "db", archive_path, quantization='float32')
+    target = tmp_path / "pratica"
+    imported = import_snapshot(archive_path, tmp_path / "db2", documents_path=str(target))
+
+    from shards import collection_name_for
+    assert imported["caso-12345678"] == collection_name_for(target)
+    collection = chromadb.PersistentClient(path=str(tmp_path / "db2")).get_collection(imported["caso-12345678"])
+    sources = sorted(m['source'] for m in collection.get(include=['metadatas'])['metadatas'])
+    assert sources == [str(target / "doc-0.txt"), str(target / "doc-1.txt")]
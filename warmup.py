@@ -0,0 +1,78 @@
+"""
+Preload dei modelli Ollama e keep-alive
+Carica LLM e modello di embedding prima della prima domanda e li tiene in memoria
+"""
+
+import json
+import time
+import urllib.request
+from typing import Any, Dict, List, Optional, Union
+
+from langchain_community.embeddings import OllamaEmbeddings
+
+
+OLLAMA_URL = "http://localhost:11434"
+
+# Quanto Ollama tiene un modello in memoria dopo l'ultima richiesta
+# (default di Ollama: 5m; "-1m" = per sempre, 0 = scarica subito)
+DEFAULT_KEEP_ALIVE = "30m"
+
+
+def _request(path: str, payload: Optional[Dict] = None, base_url: str = OLLAMA_URL,
+             timeout: int = 600) -> Dict:
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    request = urllib.request.Request(
+        f"{base_url}{path}",
+        data=data,
+        headers={'Content-Type': 'application/json'},
+        method='POST' if data is not None else 'GET'
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode('utf-8') or '{}')
+
+
+def preload_llm(model: str, keep_alive: Union[int, str] = DEFAULT_KEEP_ALIVE,
+                base_url: str = OLLAMA_URL, num_ctx: Optional[int] = None) -> float:
+    """Load an LLM into Ollama memory (empty prompt); returns seconds taken"""
+    payload = {'model': model, 'prompt': '', 'keep_alive': keep_alive, 'stream': False}
+    # Stesso num_ctx delle richieste: con un valore diverso Ollama ricarica il modello
+    if num_ctx:
+        payload['options'] = {'num_ctx': num_ctx}
+    start = time.perf_counter()
+    _request('/api/generate', payload, base_url)
+    return time.perf_counter() - start
+
+
+def preload_embeddings(model: str, keep_alive: Union[int, str] = DEFAULT_KEEP_ALIVE,
+                       base_url: str = OLLAMA_URL) -> float:
+    """Load an embedding model with a one-word request; returns seconds taken"""
+    start = time.perf_counter()
+    _request('/api/embeddings', {'model': model, 'prompt': 'warmup', 'keep_alive': keep_alive},
+             base_url)
+    return time.perf_counter() - start
+
+
+def loaded_models(base_url: str = OLLAMA_URL) -> List[Dict]:
+    """Models currently in Ollama memory (/api/ps), [] if unavailable"""
+    try:
+        return _request('/api/ps', base_url=base_url, timeout=5).get('models', [])
+    except Exception:
+        return []
+
+
+def is_loaded(model: str, base_url: str = OLLAMA_URL) -> bool:
+    names = {m.get('name') for m in loaded_models(base_url)}
+    return model in names or f"{model}:latest" in names
+
+
+class KeepAliveOllamaEmbeddings(OllamaEmbeddings):
+    """OllamaEmbeddings sending keep_alive with every request"""
+
+    keep_alive: Optional[Any] = None
+
+    @property
+    def _default_params(self) -> Dict[str, Any]:
+        params = super()._default_params
+        if self.keep_alive is not None:
+            params['keep_alive'] = self.keep_alive
+        return params